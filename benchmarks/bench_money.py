@@ -0,0 +1,49 @@
+'''
+Cost of the money representation: ingest latency through the process view, and
+scoring throughput on receipts already in memory (items prefetched), so that only
+the parsing and arithmetic on totals and prices is measured.
+
+    python benchmarks/bench_money.py --receipts 2000 --rounds 20
+
+Run it on two checkouts to compare representations.
+'''
+import argparse
+import json
+import statistics
+
+from common import SAMPLE_RECEIPT, Timer, percentile, post_receipt, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=20, help="times to score every receipt")
+    args = parser.parse_args()
+
+    setup_django()
+    from receipts.models import Receipt
+
+    receipt = {**SAMPLE_RECEIPT, "items": SAMPLE_RECEIPT["items"] * 5}
+    ingest = []
+    for _ in range(args.receipts):
+        with Timer() as timer:
+            post_receipt(receipt)
+        ingest.append(timer.elapsed)
+
+    receipts = list(Receipt.objects.prefetch_related("item_set"))
+    rounds = []
+    for _ in range(args.rounds):
+        with Timer() as timer:
+            for stored in receipts:
+                stored.get_points()
+        rounds.append(timer.elapsed / len(receipts))
+
+    print(json.dumps({
+        "process_p50_ms": percentile(ingest, 0.50) * 1000,
+        "process_p99_ms": percentile(ingest, 0.99) * 1000,
+        "scoring_us_per_receipt": statistics.median(rounds) * 1e6,
+    }))
+
+
+if __name__ == "__main__":
+    main()
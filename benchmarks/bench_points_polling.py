@@ -0,0 +1,58 @@
+'''
+Bandwidth and latency of clients that repeatedly poll the points endpoint,
+with and without sending back the ETag they got on their first poll.
+
+    python benchmarks/bench_points_polling.py --receipts 200 --polls 20
+'''
+import argparse
+
+from common import Timer, client, percentile, post_receipt, response_bytes, setup_django
+
+
+def poll(http, receipt_ids: list[str], polls: int, conditional: bool) -> dict:
+    latencies, total_bytes = [], 0
+    for receipt_id in receipt_ids:
+        url = f"/receipts/{receipt_id}/points"
+        etag = http.get(url)["ETag"]
+        headers = {"If-None-Match": etag} if conditional else {}
+        for _ in range(polls):
+            with Timer() as timer:
+                response = http.get(url, headers=headers)
+            assert response.status_code == (304 if conditional else 200)
+            latencies.append(timer.elapsed)
+            total_bytes += response_bytes(response)
+    return {
+        "requests": len(latencies),
+        "bytes": total_bytes,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=200)
+    parser.add_argument("--polls", type=int, default=20, help="Repeat polls per receipt after the first one.")
+    args = parser.parse_args()
+
+    setup_django()
+    receipt_ids = [post_receipt() for _ in range(args.receipts)]
+    http = client()
+
+    results = {
+        "unconditional": poll(http, receipt_ids, args.polls, conditional=False),
+        "If-None-Match": poll(http, receipt_ids, args.polls, conditional=True),
+    }
+    print(f"{'polling':>14} {'requests':>9} {'bytes':>10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:>14} {result['requests']:>9} {result['bytes']:>10} "
+            f"{result['mean_ms']:>8.3f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}"
+        )
+    saved = 1 - results["If-None-Match"]["bytes"] / results["unconditional"]["bytes"]
+    print(f"bytes saved: {saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
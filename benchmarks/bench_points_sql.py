@@ -0,0 +1,44 @@
+'''
+Scoring every stored receipt in Python (receipts and items loaded, then get_points)
+against scoring them in SQL with Receipt.objects.with_points(), on shard 0.
+
+    python benchmarks/bench_points_sql.py --receipts 2000 --rounds 5
+'''
+import argparse
+import json
+import statistics
+
+from common import SAMPLE_RECEIPT, Timer, post_receipt, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5, help="times to score every receipt each way")
+    args = parser.parse_args()
+
+    setup_django()
+    from receipts.models import Receipt
+
+    for _ in range(args.receipts):
+        post_receipt(SAMPLE_RECEIPT)
+
+    python_rounds, sql_rounds = [], []
+    for _ in range(args.rounds):
+        with Timer() as timer:
+            python_points = {receipt.pk: receipt.get_points() for receipt in Receipt.objects.prefetch_related("item_set")}
+        python_rounds.append(timer.elapsed)
+        with Timer() as timer:
+            sql_points = dict(Receipt.objects.with_points().values_list("pk", "computed_points"))
+        sql_rounds.append(timer.elapsed)
+        assert sql_points == python_points
+
+    print(json.dumps({
+        "receipts": len(sql_points),
+        "python_ms": statistics.median(python_rounds) * 1000,
+        "sql_ms": statistics.median(sql_rounds) * 1000,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+'''
+Ingest latency with inline vs background scoring, and background scoring
+throughput as the number of worker processes grows.
+
+    python benchmarks/bench_scoring_pipeline.py --receipts 2000 --processes 1 2 4
+
+Each configuration runs in its own process against fresh databases. Workers are
+timed draining a backlog of `--receipts` queued jobs, from the moment every worker
+process has started and set Django up, so process startup isn't counted as scoring
+time. With more than one shard (RECEIPTS_SHARD_COUNT) their writes also stop
+contending for a single file.
+'''
+import argparse
+import json
+import threading
+
+from common import SAMPLE_RECEIPT, Timer, percentile, post_receipt, run_configuration, setup_django
+
+
+def big_receipt(items: int) -> dict:
+    # scoring cost grows with the number of items
+    return {**SAMPLE_RECEIPT, "items": SAMPLE_RECEIPT["items"] * (items // len(SAMPLE_RECEIPT["items"]))}
+
+
+def run_ingest(receipts: int, threads: int, items: int) -> dict:
+    setup_django()
+    from django.db import connections
+
+    receipt = big_receipt(items)
+    latencies = [[] for _ in range(threads)]
+
+    def work(index):
+        try:
+            for _ in range(receipts // threads):
+                with Timer() as timer:
+                    post_receipt(receipt)
+                latencies[index].append(timer.elapsed)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    samples = [latency for thread_latencies in latencies for latency in thread_latencies]
+    return {"p50_ms": percentile(samples, 0.50) * 1000, "p99_ms": percentile(samples, 0.99) * 1000}
+
+
+def drain_jobs(ready):
+    # entry point of each worker process, under the spawn start method like run_scoring_workers
+    setup_django()
+    from receipts.scoring import run_worker
+
+    ready.wait()
+    run_worker(threading.Event(), drain=True)
+
+
+def run_workers(receipts: int, processes: int, items: int) -> dict:
+    setup_django()
+    import multiprocessing
+
+    from django.db import connections
+
+    receipt = big_receipt(items)
+    for _ in range(receipts):
+        post_receipt(receipt)
+    # children must not share this process's SQLite connections
+    connections.close_all()
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(processes + 1)
+    children = [context.Process(target=drain_jobs, args=(ready,)) for _ in range(processes)]
+    for child in children:
+        child.start()
+    ready.wait()
+    with Timer() as timer:
+        for child in children:
+            child.join()
+    return {"seconds": timer.elapsed, "receipts_per_second": receipts / timer.elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=40, help="Items per receipt.")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent ingest threads.")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--worker", choices=["ingest", "workers"], help=argparse.SUPPRESS)
+    parser.add_argument("--worker-processes", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "ingest":
+        print(json.dumps(run_ingest(args.receipts, args.threads, args.items)))
+        return
+    if args.worker == "workers":
+        print(json.dumps(run_workers(args.receipts, args.worker_processes, args.items)))
+        return
+
+    common_args = ["--receipts", str(args.receipts), "--items", str(args.items), "--threads", str(args.threads)]
+    print(f"{'ingest':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for scoring in ["inline", "background"]:
+        result = run_configuration(__file__, ["--worker", "ingest", *common_args], {"RECEIPTS_SCORING": scoring})
+        print(f"{scoring:>10} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+    print(f"\n{'processes':>10} {'receipts/s':>11}")
+    for processes in args.processes:
+        result = run_configuration(
+            __file__,
+            ["--worker", "workers", "--worker-processes", str(processes), *common_args],
+            {"RECEIPTS_SCORING": "background"},
+        )
+        print(f"{processes:>10} {result['receipts_per_second']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+'''
+Concurrent ingest throughput as the number of SQLite shards grows.
+
+    python benchmarks/bench_shard_writes.py --shards 1 2 4 8 --threads 8 --receipts 2000
+
+Each shard count runs in its own process against fresh databases. Every thread
+posts receipts through the process view, so the numbers include JSON parsing,
+ID generation, the collision check and the receipt + items inserts.
+'''
+import argparse
+import json
+import threading
+
+from common import Timer, percentile, post_receipt, run_configuration, setup_django
+
+
+def run_worker(threads: int, receipts: int) -> dict:
+    setup_django()
+    from django.db import connections
+
+    per_thread = receipts // threads
+    latencies = [[] for _ in range(threads)]
+
+    def work(index):
+        try:
+            for _ in range(per_thread):
+                with Timer() as timer:
+                    post_receipt()
+                latencies[index].append(timer.elapsed)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    with Timer() as wall:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    samples = [latency for thread_latencies in latencies for latency in thread_latencies]
+    return {
+        "receipts": len(samples),
+        "seconds": wall.elapsed,
+        "receipts_per_second": len(samples) / wall.elapsed,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.threads, args.receipts)))
+        return
+
+    print(f"{'shards':>6} {'receipts/s':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for shards in args.shards:
+        result = run_configuration(
+            __file__,
+            ["--worker", "--threads", str(args.threads), "--receipts", str(args.receipts)],
+            {"RECEIPTS_SHARD_COUNT": shards},
+        )
+        print(f"{shards:>6} {result['receipts_per_second']:>11.1f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+'''
+Ingest and points latency through the full middleware stack, per storage backend.
+
+    python benchmarks/bench_storage_backends.py --receipts 2000
+
+Each backend runs in its own process against fresh databases.
+'''
+import argparse
+import json
+
+from common import SAMPLE_RECEIPT, Timer, client, percentile, run_configuration, setup_django
+
+BACKENDS = {
+    "orm": "receipts.storage.ORMReceiptStore",
+    "memory": "receipts.storage.InMemoryReceiptStore",
+}
+
+
+def run_worker(receipts: int) -> dict:
+    setup_django()
+    http = client()
+    body = {"receipt_json_str": json.dumps(SAMPLE_RECEIPT)}
+
+    ingest, points, receipt_ids = [], [], []
+    for _ in range(receipts):
+        with Timer() as timer:
+            response = http.post("/receipts/process", body)
+        ingest.append(timer.elapsed)
+        receipt_ids.append(json.loads(response.content)["id"])
+    for receipt_id in receipt_ids:
+        with Timer() as timer:
+            http.get(f"/receipts/{receipt_id}/points")
+        points.append(timer.elapsed)
+
+    return {
+        name: {"p50_ms": percentile(samples, 0.50) * 1000, "p99_ms": percentile(samples, 0.99) * 1000}
+        for name, samples in (("process", ingest), ("points", points))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.receipts)))
+        return
+
+    print(f"{'backend':>8} {'endpoint':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, path in BACKENDS.items():
+        result = run_configuration(__file__, ["--worker", "--receipts", str(args.receipts)], {"RECEIPTS_STORAGE_BACKEND": path})
+        for endpoint, latency in result.items():
+            print(f"{name:>8} {endpoint:>9} {latency['p50_ms']:>8.3f} {latency['p99_ms']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
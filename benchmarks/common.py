@@ -0,0 +1,101 @@
+'''
+Shared helpers for the scripts in this directory.
+
+Every benchmark runs against a throwaway set of SQLite files in a temp directory,
+never against the project's own db.sqlite3. Settings that are read at import time
+(shard count, database directory, ...) are passed through the environment, so a
+benchmark that compares configurations re-runs itself in a subprocess per configuration.
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SAMPLE_RECEIPT = {
+    "retailer": "M&M Corner Market",
+    "purchaseDate": "2022-03-21",
+    "purchaseTime": "14:33",
+    "items": [
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+        {"shortDescription": "   Klarbrunn 12-PK 12 FL OZ  ", "price": "12.00"},
+    ],
+    "total": "28.75",
+}
+
+
+def setup_django(**env):
+    '''
+    Point Django at a fresh temp database directory (unless one is already set),
+    apply `env` on top of os.environ, and migrate every configured database.
+    '''
+    os.environ.update({key: str(value) for key, value in env.items()})
+    os.environ.setdefault("RECEIPTS_DATABASE_DIR", tempfile.mkdtemp(prefix="receipts-bench-"))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    sys.path.insert(0, str(BASE_DIR))
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    for alias in settings.DATABASES:
+        call_command("migrate", database=alias, verbosity=0)
+
+
+def run_configuration(script: str, args: list[str], env: dict) -> dict:
+    '''
+    Re-run `script` in a subprocess with `env` applied, and return the JSON
+    object it prints on its last line of stdout.
+    '''
+    child_env = {**os.environ, **{key: str(value) for key, value in env.items()}}
+    child_env["RECEIPTS_DATABASE_DIR"] = tempfile.mkdtemp(prefix="receipts-bench-")
+    output = subprocess.run(
+        [sys.executable, script, *args], env=child_env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def post_receipt(receipt: dict = SAMPLE_RECEIPT) -> str:
+    '''Ingest `receipt` through the process view and return its ID.'''
+    from django.test import RequestFactory
+    from receipts import views
+
+    request = RequestFactory().post("/receipts/process", {"receipt_json_str": json.dumps(receipt)})
+    response = views.get_id_for_receipt(request)
+    assert response.status_code == 200, response.content
+    return json.loads(response.content)["id"]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def client():
+    '''A test client that goes through the full middleware stack.'''
+    from django.test import Client
+
+    # 'localhost' is allowed by the default ALLOWED_HOSTS while DEBUG is on
+    return Client(HTTP_HOST="localhost")
+
+
+def response_bytes(response) -> int:
+    '''Approximate size on the wire: status line, headers and body.'''
+    headers = sum(len(f"{name}: {value}\r\n") for name, value in response.items())
+    return len("HTTP/1.1 200 OK\r\n\r\n") + headers + len(response.content)
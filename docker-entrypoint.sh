@@ -0,0 +1,20 @@
+#!/bin/sh
+set -e
+
+# Seed the data directory from the migrated database template baked into the image.
+# Existing files (e.g. on a mounted volume) are left alone.
+mkdir -p "$RECEIPTS_DATABASE_DIR"
+for template in "$RECEIPTS_DB_TEMPLATE_DIR"/*.sqlite3; do
+    # the glob stays unexpanded when there is no template
+    [ -e "$template" ] || continue
+    target="$RECEIPTS_DATABASE_DIR/$(basename "$template")"
+    [ -e "$target" ] || cp "$template" "$target"
+done
+
+# A volume written by an older image may need newer migrations; opt in, since it costs a
+# full Django boot and a walk of the migration graph.
+if [ "$RECEIPTS_MIGRATE_ON_START" = "1" ]; then
+    python manage.py migrate_shards --verbosity 0
+fi
+
+exec "$@"
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    from mysite import startup
+
+    startup.mark("manage.py started")
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
     try:
         from django.core.management import execute_from_command_line
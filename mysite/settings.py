@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,14 +43,66 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'receipts.middleware.AdmissionControlMiddleware',
+    'receipts.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # last, so that it profiles the view only
+    'receipts.profiling.ProfilingMiddleware',
 ]
 
+# Admission control (receipts/middleware.py), per worker process. At most
+# RECEIPTS_MAX_INFLIGHT_INGESTS receipts are ingested at once; further ingests wait
+# up to RECEIPTS_MAX_INGEST_QUEUE_SECONDS for a slot and are then shed with a 503
+# and Retry-After. Points reads have their own, larger budget, and ingests are shed
+# first while reads are saturating it.
+RECEIPTS_MAX_INFLIGHT_INGESTS = int(os.environ.get('RECEIPTS_MAX_INFLIGHT_INGESTS', 4))
+RECEIPTS_MAX_INGEST_QUEUE_SECONDS = float(os.environ.get('RECEIPTS_MAX_INGEST_QUEUE_SECONDS', 0.5))
+RECEIPTS_MAX_INFLIGHT_READS = int(os.environ.get('RECEIPTS_MAX_INFLIGHT_READS', 32))
+RECEIPTS_RETRY_AFTER_SECONDS = int(os.environ.get('RECEIPTS_RETRY_AFTER_SECONDS', 1))
+
+# 'inline' scores receipts during ingest and stores the result. 'background' only
+# stores the receipt and queues a ScoringJob for `manage.py run_scoring_workers`,
+# so scoring runs outside the server processes. That doesn't make ingest faster: inline
+# scoring happens in memory and costs less than the job insert
+# (benchmarks/bench_scoring_pipeline.py). Points requests for a receipt
+# that is still queued are answered by scoring it on the spot ('inline') or with a
+# 202 Accepted ('accepted').
+RECEIPTS_SCORING = os.environ.get('RECEIPTS_SCORING', 'inline')
+RECEIPTS_PENDING_POINTS_RESPONSE = os.environ.get('RECEIPTS_PENDING_POINTS_RESPONSE', 'inline')
+
+# Where the views keep receipts (see receipts/storage.py): the sharded SQLite models,
+# or 'receipts.storage.InMemoryReceiptStore' for deployments that only need receipts
+# for a short window. The in-memory store is per process, keeps at most
+# RECEIPTS_MEMORY_MAX_RECEIPTS receipts (oldest evicted first) and splits them over
+# RECEIPTS_MEMORY_STRIPES independently locked dicts.
+RECEIPTS_STORAGE_BACKEND = os.environ.get('RECEIPTS_STORAGE_BACKEND', 'receipts.storage.ORMReceiptStore')
+RECEIPTS_MEMORY_MAX_RECEIPTS = int(os.environ.get('RECEIPTS_MEMORY_MAX_RECEIPTS', 100_000))
+RECEIPTS_MEMORY_STRIPES = int(os.environ.get('RECEIPTS_MEMORY_STRIPES', 16))
+
+# Log (and count in /receipts/metrics) every request whose view runs more SQL
+# statements than its declared @query_budget, with fingerprints of the offending SQL.
+RECEIPTS_QUERY_BUDGET_WARNINGS = os.environ.get('RECEIPTS_QUERY_BUDGET_WARNINGS', '0') == '1'
+
+# Print a breakdown of the time from process start to the first served request
+# to stderr (see mysite/startup.py). On in the Docker image.
+RECEIPTS_STARTUP_REPORT = os.environ.get('RECEIPTS_STARTUP_REPORT', '0') == '1'
+
+# On-demand profiling (receipts/profiling.py). With RECEIPTS_PROFILING on, a view is
+# run under cProfile, with its SQL timed, for requests carrying the header
+# `X-Receipts-Profile: <RECEIPTS_PROFILING_TOKEN>` (ignored while the token is empty)
+# and for a random RECEIPTS_PROFILING_SAMPLE_RATE of all requests. The last
+# RECEIPTS_PROFILING_MAX_PROFILES profiles per process are served to staff users
+# at /receipts/profiles.
+RECEIPTS_PROFILING = os.environ.get('RECEIPTS_PROFILING', '0') == '1'
+RECEIPTS_PROFILING_TOKEN = os.environ.get('RECEIPTS_PROFILING_TOKEN', '')
+RECEIPTS_PROFILING_SAMPLE_RATE = float(os.environ.get('RECEIPTS_PROFILING_SAMPLE_RATE', 0))
+RECEIPTS_PROFILING_MAX_PROFILES = int(os.environ.get('RECEIPTS_PROFILING_MAX_PROFILES', 20))
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -74,12 +127,55 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Directory holding the SQLite files. Overridable so that benchmarks and
+# containers can point the service at a scratch or mounted directory.
+DATABASE_DIR = Path(os.environ.get('RECEIPTS_DATABASE_DIR', BASE_DIR))
+
+# Receipt and Item rows are hash-sharded by receipt ID prefix across this many
+# SQLite files, so that writes to different shards don't serialize on a single
+# database lock. Shard 0 is always 'default'; see receipts/routers.py.
+# Run `manage.py reshard_receipts` after changing this on an existing install.
+RECEIPTS_SHARD_COUNT = int(os.environ.get('RECEIPTS_SHARD_COUNT', 1))
+
+
+def sqlite_database(name):
+    return {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': DATABASE_DIR / name,
+        'OPTIONS': {
+            # seconds to wait on a locked database before raising
+            'timeout': 20,
+            # take the write lock when a transaction starts, so concurrent writers
+            # queue on the busy timeout instead of failing a read->write lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
+
+
+# When enabled, read-only receipt traffic (points lookups, listings) is served from
+# a snapshot copy of each shard that is refreshed with SQLite's online backup API
+# every RECEIPTS_REPLICA_REFRESH_SECONDS, so long reads don't contend with ingest
+# writes. Receipts newer than the snapshot fall back to the primary.
+RECEIPTS_READ_REPLICA = os.environ.get('RECEIPTS_READ_REPLICA', '0') == '1'
+RECEIPTS_REPLICA_REFRESH_SECONDS = float(os.environ.get('RECEIPTS_REPLICA_REFRESH_SECONDS', 5))
+
+
+def sqlite_replica(primary_alias, name):
+    replica = sqlite_database(name)
+    # tests read straight from the primary's test database
+    replica['TEST'] = {'MIRROR': primary_alias}
+    return replica
+
+
+DATABASES = {
+    'default': sqlite_database('db.sqlite3'),
+    'default_replica': sqlite_replica('default', 'db.replica.sqlite3'),
 }
+for shard in range(1, RECEIPTS_SHARD_COUNT):
+    DATABASES[f'shard_{shard}'] = sqlite_database(f'db_shard_{shard}.sqlite3')
+    DATABASES[f'shard_{shard}_replica'] = sqlite_replica(f'shard_{shard}', f'db_shard_{shard}.replica.sqlite3')
+
+DATABASE_ROUTERS = ['receipts.routers.ReceiptShardRouter']
 
 
 # Password validation
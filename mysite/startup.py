@@ -0,0 +1,81 @@
+'''
+Startup timing: how long a process takes from exec to serving its first request.
+
+Entry points (manage.py, wsgi.py) and a few later milestones call `mark()`. With
+RECEIPTS_STARTUP_REPORT on, the breakdown is written to stderr once the first request
+has been served. Startup ends at HANDLER_READY, or at LISTENING when the server marks
+it; the wait from there to the first request is idle time and is reported apart, as
+is the first request itself. Deliberately has no Django imports so it can be loaded first.
+'''
+import os
+import sys
+import time
+
+HANDLER_READY = "handler ready"
+LISTENING = "listening"
+FIRST_REQUEST_RECEIVED = "first request received"
+FIRST_REQUEST_SERVED = "first request served"
+
+_marks = []
+_first_request_seen = False
+_reported = False
+
+
+def _seconds_since_exec() -> float | None:
+    # Linux only: process start time is field 22 of /proc/self/stat, in clock ticks since boot
+    try:
+        with open("/proc/self/stat") as stat, open("/proc/uptime") as uptime:
+            # the command name (field 2) may contain spaces, so split after its closing paren
+            fields = stat.read().rsplit(")", 1)[1].split()
+            started_ticks = int(fields[19])
+            uptime_seconds = float(uptime.read().split()[0])
+        return uptime_seconds - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def mark(label: str):
+    if not _marks:
+        since_exec = _seconds_since_exec()
+        if since_exec is not None:
+            _marks.append(("process exec", time.perf_counter() - since_exec))
+    _marks.append((label, time.perf_counter()))
+
+
+def report() -> str:
+    lines = ["Startup timing:"]
+    for (_, previous), (label, at) in zip(_marks, _marks[1:]):
+        if label == FIRST_REQUEST_RECEIVED:
+            label = "idle until first request"
+        lines.append(f"  {label:<28} +{(at - previous) * 1000:8.1f} ms")
+    if not _marks:
+        return "\n".join(lines)
+
+    times = dict(_marks)
+    ready = times.get(LISTENING, times.get(HANDLER_READY))
+    if ready is None:
+        lines.append(f"  {'total':<28}  {(_marks[-1][1] - _marks[0][1]) * 1000:8.1f} ms")
+    else:
+        lines.append(f"  {'startup total':<28}  {(ready - _marks[0][1]) * 1000:8.1f} ms")
+    if FIRST_REQUEST_RECEIVED in times and FIRST_REQUEST_SERVED in times:
+        lines.append(f"  {'first request':<28}  {(times[FIRST_REQUEST_SERVED] - times[FIRST_REQUEST_RECEIVED]) * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+def report_first_request(**kwargs):
+    # connected to request_finished when RECEIPTS_STARTUP_REPORT is on
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    mark(FIRST_REQUEST_SERVED)
+    print(report(), file=sys.stderr, flush=True)
+
+
+def mark_first_request(**kwargs):
+    # connected to request_started; only the first request counts
+    global _first_request_seen
+    if _first_request_seen:
+        return
+    _first_request_seen = True
+    mark(FIRST_REQUEST_RECEIVED)
@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
+from mysite import startup
+
+startup.mark("wsgi.py started")
+
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# import the URLconf, and with it every view and the admin's URLs, before the server
+# starts listening rather than during the first request
+from django.urls import get_resolver
+
+get_resolver().url_patterns
+
+startup.mark(startup.HANDLER_READY)
@@ -1,6 +1,169 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 
-from .models import Receipt, Item
+from .models import Receipt, Item, cents_to_dollars
+from .pagination import KEYSET_ORDERING, keyset_page
+from .routers import db_for_receipt_id, shard_aliases
 
-admin.site.register(Receipt)
-admin.site.register(Item)
+# query string parameter holding the changelist's keyset cursor
+CURSOR_VAR = "after"
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    A paginator that never runs an unbounded COUNT(*). Unfiltered lists are sized from
+    the table's largest rowid, which SQLite finds without scanning the table; filtered
+    ones are counted up to `count_limit` rows.
+    '''
+    count_limit = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_is_estimate = False
+        self.count_is_capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.has_filters() and connection.vendor == "sqlite":
+            self.count_is_estimate = True
+            # only overcounts by the rows deleted from the middle of the table
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(queryset.model._meta.db_table)}")
+                return cursor.fetchone()[0] or 0
+        count = queryset.order_by()[:self.count_limit].count()
+        self.count_is_capped = count == self.count_limit
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    '''
+    A changelist that pages with a keyset cursor (`?after=...`) instead of page numbers,
+    in KEYSET_ORDERING, so every page costs the same however deep it is.
+    '''
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # changing filters, search or ordering starts over from the first page
+        return super().get_query_string(new_params, [CURSOR_VAR, *(remove or [])])
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        cursor = self.params.get(CURSOR_VAR)
+        try:
+            result_list, next_cursor = keyset_page(self.queryset, cursor, self.list_per_page)
+        except ValueError:
+            raise IncorrectLookupParameters
+
+        self.result_count = paginator.count
+        self.result_count_is_estimate = paginator.count_is_estimate
+        self.result_count_is_capped = paginator.count_is_capped
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = cursor is not None or next_cursor is not None
+        self.paginator = paginator
+        self.first_page_url = self.get_query_string() if cursor else None
+        self.next_page_url = super().get_query_string({CURSOR_VAR: next_cursor}) if next_cursor else None
+
+
+class ShardFilter(admin.SimpleListFilter):
+    '''
+    Which shard's receipts to list. Shard 0 is listed by default; there's no "All",
+    since listing every shard at once would mean merging them page by page.
+    '''
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        aliases = shard_aliases()
+        if len(aliases) == 1:
+            return []
+        return [(str(shard), alias) for shard, alias in enumerate(aliases)]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            return queryset.using(dict(self.lookup_choices)[self.value()])
+        except KeyError:
+            raise IncorrectLookupParameters(f"No shard {self.value()}")
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.value() == lookup or (self.value() is None and lookup == "0"),
+                "query_string": changelist.get_query_string({self.parameter_name: lookup}),
+                "display": title,
+            }
+
+
+class ItemInline(admin.TabularInline):
+    model = Item
+    fields = ("shortDescription", "price_cents")
+    extra = 0
+
+
+@admin.register(Receipt)
+class ReceiptAdmin(admin.ModelAdmin):
+    list_display = ("hexadecimal_id", "retailer", "purchaseDate", "purchaseTime", "total", "points")
+    list_filter = (ShardFilter, ("purchaseDate", admin.DateFieldListFilter))
+    search_fields = ("retailer",)
+    search_help_text = "Receipt ID, or the start of a retailer name (case-sensitive)."
+    ordering = KEYSET_ORDERING
+    # the keyset cursor only works in KEYSET_ORDERING
+    sortable_by = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ("points",)
+    inlines = (ItemInline,)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @admin.display(description="total")
+    def total(self, receipt):
+        return cents_to_dollars(receipt.total_cents)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # a prefix match written as a range, which the retailer index can serve
+        # (SQLite's LIKE is case-insensitive, so it can't use a plain index)
+        matches = Q(pk=search_term) | Q(retailer__gte=search_term, retailer__lt=search_term + "\U0010ffff")
+        return queryset.filter(matches), False
+
+    def get_object(self, request, object_id, from_field=None):
+        # the receipt ID picks the shard; the default queryset only sees shard 0
+        try:
+            return self.get_queryset(request).using(db_for_receipt_id(object_id)).get(pk=object_id)
+        except (Receipt.DoesNotExist, ValidationError):
+            return None
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj._state.db is not None:
+            # items live on their receipt's shard
+            kwargs["queryset"] = kwargs["queryset"].using(obj._state.db)
+        return kwargs
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the receipt or its items may have changed, so store a fresh score
+        receipt = form.instance
+        receipt.points = receipt.get_points()
+        receipt.save(update_fields=["points"])
@@ -1,6 +1,29 @@
+from functools import partial
+
 from django.apps import AppConfig
 
 
 class ReceiptsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'receipts'
+
+    def ready(self):
+        from django.conf import settings
+
+        if settings.RECEIPTS_STARTUP_REPORT:
+            from django.core.signals import request_finished, request_started
+
+            from mysite import startup
+
+            startup.mark("apps ready")
+            request_started.connect(startup.mark_first_request)
+            request_finished.connect(startup.report_first_request)
+
+        # only pay for the replica machinery (and its imports) when it's in use
+        if settings.RECEIPTS_READ_REPLICA:
+            from . import metrics
+            from .replicas import replica_lag_seconds
+            from .routers import shard_aliases
+
+            for alias in shard_aliases():
+                metrics.register_gauge(f"replica_lag_seconds.{alias}", partial(replica_lag_seconds, alias))
@@ -0,0 +1,308 @@
+'''
+Traffic replay against a running server (see the replay_traffic command).
+
+A trace is NDJSON, one request per line, in the order they were sent:
+
+    {"t": 0.000, "endpoint": "process", "receipt": {"retailer": "Target", ...}}
+    {"t": 0.012, "endpoint": "points", "ref": 0}
+    {"t": 0.020, "endpoint": "points", "id": "c288fc46-3b6-8b4c-830d-77c75e9644e6"}
+
+`t` is when the request was sent, in seconds from the start of the trace. A points
+request names its receipt either by `id`, for receipts already on the server, or by
+`ref`, the line number (from 0) of the process request in this trace whose ID to use.
+
+Replays are either open-loop, sending every request at its scheduled time whether or
+not earlier ones have returned, or closed-loop, with a fixed number of clients each
+sending its next request as soon as its last one returns. Open-loop latencies are
+measured from the scheduled send time, so a server that falls behind is charged for
+the time requests spent waiting to be sent, not only for the time it took to answer.
+'''
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+ENDPOINTS = ("process", "points")
+
+RETAILERS = ("Target", "Walgreens", "M&M Corner Market", "Costco", "Trader Joe's")
+PRODUCTS = ("Mountain Dew 12PK", "Emils Cheese Pizza", "Knorr Creamy Chicken", "Doritos Nacho Cheese", "Gatorade", "Pepsi - 12-oz", "Dasani")
+
+
+class LatencyHistogram:
+    '''
+    Latencies in log-linear buckets, as HdrHistogram keeps them: every power-of-two
+    range of microseconds is split into SUB_BUCKETS equal buckets, so each recorded
+    latency is known to within 1/SUB_BUCKETS of its value, in memory that doesn't
+    grow with the number of requests.
+    '''
+    SUB_BUCKETS = 128
+
+    def __init__(self):
+        self.counts = Counter()
+        self.count = 0
+        self.max = 0
+
+    def bucket(self, micros: int) -> int:
+        # the smallest value of the bucket `micros` falls in
+        shift = max(0, micros.bit_length() - self.SUB_BUCKETS.bit_length())
+        return micros >> shift << shift
+
+    def highest_equivalent(self, bucket: int) -> int:
+        shift = max(0, bucket.bit_length() - self.SUB_BUCKETS.bit_length())
+        return bucket + (1 << shift) - 1
+
+    def record(self, seconds: float):
+        micros = max(0, round(seconds * 1e6))
+        self.counts[self.bucket(micros)] += 1
+        self.count += 1
+        self.max = max(self.max, micros)
+
+    def percentile(self, percent: float) -> float:
+        '''The latency in seconds that `percent`% of the recorded ones don't exceed.'''
+        if not self.count:
+            return 0.0
+        rank = max(1, round(percent / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.highest_equivalent(bucket), self.max) / 1e6
+        return self.max / 1e6
+
+
+def synthetic_receipt(rng: random.Random) -> dict:
+    items = [
+        {"shortDescription": rng.choice(PRODUCTS), "price": f"{rng.randint(50, 2500) / 100:.2f}"}
+        for _ in range(rng.randint(1, 8))
+    ]
+    total = sum(round(float(item["price"]) * 100) for item in items)
+    return {
+        "retailer": rng.choice(RETAILERS),
+        "purchaseDate": f"2022-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+        "purchaseTime": f"{rng.randint(0, 23):02}:{rng.randint(0, 59):02}",
+        "items": items,
+        "total": f"{total // 100}.{total % 100:02}",
+    }
+
+
+def synthetic_trace(requests: int, rate: float, points_ratio: float, seed: int = 0) -> list[dict]:
+    '''
+    `requests` requests arriving as a Poisson process at `rate` per second. About
+    `points_ratio` of them look up the points of a receipt processed earlier on.
+    '''
+    rng = random.Random(seed)
+    trace, processed, t = [], [], 0.0
+    for line in range(requests):
+        if processed and rng.random() < points_ratio:
+            trace.append({"t": round(t, 6), "endpoint": "points", "ref": rng.choice(processed)})
+        else:
+            trace.append({"t": round(t, 6), "endpoint": "process", "receipt": synthetic_receipt(rng)})
+            processed.append(line)
+        t += rng.expovariate(rate)
+    return trace
+
+
+def read_trace(lines) -> list[dict]:
+    '''Parse and check an NDJSON trace. Raises ValueError on the first bad line.'''
+    trace = []
+    for number, line in enumerate(line for line in lines if line.strip()):
+        request = json.loads(line)
+        endpoint = request.get("endpoint")
+        if endpoint == "process":
+            valid = isinstance(request.get("receipt"), dict)
+        elif endpoint == "points":
+            ref = request.get("ref")
+            valid = "id" in request or (isinstance(ref, int) and 0 <= ref < number and trace[ref]["endpoint"] == "process")
+        else:
+            valid = False
+        if not valid:
+            raise ValueError(f"Invalid trace line {number}: {line.strip()}")
+        trace.append(request)
+    return trace
+
+
+class ReceiptsClient:
+    '''
+    A connection to the server, plus the CSRF cookie and token that POST
+    /receipts/process requires, fetched from the upload form on first use.
+
+    Unless `keep_alive` is set, every request goes over a new connection: Django's
+    development server writes its responses in several small pieces, and on a reused
+    connection each response then stalls for a delayed ACK (40 ms on Linux).
+    '''
+
+    def __init__(self, base_url: str, timeout: float, keep_alive: bool = False):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout=timeout)
+        self.base_url = base_url.rstrip("/")
+        self.prefix = url.path.rstrip("/")
+        self.csrf_token = None
+        self.keep_alive = keep_alive
+
+    def request(self, method: str, path: str, body=None, headers=None) -> tuple[int, bytes, http.client.HTTPMessage]:
+        headers = dict(headers or {})
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+        for attempt in range(2):
+            try:
+                self.connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read(), response.headers
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server closed an idle keep-alive connection before reading the request
+                self.connection.close()
+                if attempt:
+                    raise
+
+    def fetch_csrf_token(self):
+        status, _, headers = self.request("GET", "/receipts/")
+        cookies = SimpleCookie()
+        for header in headers.get_all("Set-Cookie") or []:
+            cookies.load(header)
+        if status != 200 or "csrftoken" not in cookies:
+            raise RuntimeError(f"Couldn't get a CSRF token from {self.base_url}/receipts/ (status {status})")
+        self.csrf_token = cookies["csrftoken"].value
+
+    def process(self, receipt: dict) -> tuple[int, str | None]:
+        if self.csrf_token is None:
+            self.fetch_csrf_token()
+        status, body, _ = self.request("POST", "/receipts/process", body=urlencode({"receipt_json_str": json.dumps(receipt)}), headers={
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Cookie": f"csrftoken={self.csrf_token}",
+            "X-CSRFToken": self.csrf_token,
+            # checked against the host on HTTPS
+            "Referer": f"{self.base_url}/receipts/",
+        })
+        return status, json.loads(body)["id"] if status == 200 else None
+
+    def points(self, receipt_id: str) -> int:
+        status, _, _ = self.request("GET", f"/receipts/{receipt_id}/points")
+        return status
+
+    def close(self):
+        self.connection.close()
+
+
+class Replay:
+    '''
+    Replays a trace and collects, per endpoint, a latency histogram and a count of
+    response statuses. Requests that fail without a response count as status 0.
+    Points requests for receipts whose process request failed are skipped.
+    '''
+
+    def __init__(self, trace: list[dict], base_url: str, timeout: float = 10.0, keep_alive: bool = False):
+        self.trace = trace
+        self.base_url = base_url
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.histograms = defaultdict(LatencyHistogram)
+        self.statuses = defaultdict(Counter)
+        self.skipped = Counter()
+        self.lock = threading.Lock()
+        # receipt IDs assigned to the trace's process requests, by line number
+        self.receipt_ids = {line: Future() for line, request in enumerate(trace) if request["endpoint"] == "process"}
+        self.local = threading.local()
+        self.clients = []
+
+    def client(self) -> ReceiptsClient:
+        # one connection per thread
+        if not hasattr(self.local, "client"):
+            self.local.client = ReceiptsClient(self.base_url, self.timeout, self.keep_alive)
+            with self.lock:
+                self.clients.append(self.local.client)
+        return self.local.client
+
+    def send(self, line: int, scheduled: float):
+        request = self.trace[line]
+        endpoint = request["endpoint"]
+        status = 0
+        try:
+            if endpoint == "process":
+                status, receipt_id = self.client().process(request["receipt"])
+                self.receipt_ids[line].set_result(receipt_id)
+            else:
+                receipt_id = request["id"] if "id" in request else self.receipt_ids[request["ref"]].result()
+                if receipt_id is None:
+                    with self.lock:
+                        self.skipped[endpoint] += 1
+                    return
+                status = self.client().points(receipt_id)
+        except Exception:
+            if endpoint == "process" and not self.receipt_ids[line].done():
+                self.receipt_ids[line].set_result(None)
+        elapsed = time.perf_counter() - scheduled
+        with self.lock:
+            self.histograms[endpoint].record(elapsed)
+            self.statuses[endpoint][status] += 1
+
+    def run_open_loop(self, concurrency: int, speed: float = 1.0) -> float:
+        '''
+        Send each request at its trace time divided by `speed`, with at most `concurrency`
+        in flight; requests due while all are busy wait, and their wait counts as latency.
+        Returns the elapsed wall time in seconds.
+        '''
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for line, request in enumerate(self.trace):
+                scheduled = start + request["t"] / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, line, scheduled)
+        return self.finish(start)
+
+    def run_closed_loop(self, concurrency: int, think_time: float = 0.0) -> float:
+        '''
+        `concurrency` clients, each sending the next request in the trace as soon as its
+        previous one returned (plus `think_time`). Returns the elapsed wall time in seconds.
+        '''
+        lines = iter(range(len(self.trace)))
+        next_lock = threading.Lock()
+
+        def client_loop():
+            while True:
+                with next_lock:
+                    line = next(lines, None)
+                if line is None:
+                    return
+                self.send(line, time.perf_counter())
+                if think_time:
+                    time.sleep(think_time)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(client_loop)
+        return self.finish(start)
+
+    def finish(self, start: float) -> float:
+        elapsed = time.perf_counter() - start
+        for client in self.clients:
+            client.close()
+        return elapsed
+
+    def report(self, elapsed: float) -> dict:
+        '''Throughput, error rate and latency percentiles (in milliseconds) per endpoint.'''
+        report = {}
+        for endpoint in ENDPOINTS:
+            histogram, statuses = self.histograms[endpoint], self.statuses[endpoint]
+            if not histogram.count and not self.skipped[endpoint]:
+                continue
+            # 202 (points still pending) and 304 (not modified) are answers too
+            errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+            report[endpoint] = {
+                "requests": histogram.count,
+                "throughput_rps": histogram.count / elapsed if elapsed else 0.0,
+                "error_rate": errors / histogram.count if histogram.count else 0.0,
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "skipped": self.skipped[endpoint],
+                **{f"p{percent:g}_ms": histogram.percentile(percent) * 1000 for percent in (50, 90, 99, 99.9)},
+                "max_ms": histogram.max / 1000,
+            }
+        return report
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from receipts.routers import shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Run migrate against every shard database ('default' included). "
+        "Replicas are skipped; they get their schema from their primary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Exit non-zero if any shard has unapplied migrations.")
+
+    def handle(self, *args, check=False, verbosity=1, **options):
+        for alias in shard_aliases():
+            if verbosity:
+                self.stdout.write(f"Migrating {alias}")
+            call_command("migrate", database=alias, interactive=False, verbosity=verbosity, check_unapplied=check)
@@ -0,0 +1,82 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from receipts.loadtest import Replay, read_trace, synthetic_trace
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay an NDJSON trace of process and points requests (see receipts/loadtest.py) against a running "
+        "server, and report throughput, error rates and latency percentiles per endpoint. "
+        "Without a trace, replays a synthetic one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("trace", nargs="?", help="NDJSON trace file, or - for stdin.")
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server to replay against.")
+        parser.add_argument("--mode", choices=("open", "closed"), default="open",
+                            help="open: send requests at their trace times; closed: each client waits for its last response.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Clients (closed loop), or most requests in flight (open loop).")
+        parser.add_argument("--speed", type=float, default=1.0, help="Open loop: replay the trace this many times faster.")
+        parser.add_argument("--think-time", type=float, default=0.0, help="Closed loop: seconds each client waits between requests.")
+        parser.add_argument("--timeout", type=float, default=10.0, help="Seconds before a request counts as failed.")
+        parser.add_argument("--keep-alive", action="store_true", help="Reuse each client's connection between requests.")
+        parser.add_argument("--requests", type=int, default=1000, help="Synthetic trace: number of requests.")
+        parser.add_argument("--rate", type=float, default=100.0, help="Synthetic trace: mean arrival rate, requests per second.")
+        parser.add_argument("--points-ratio", type=float, default=0.8, help="Synthetic trace: share of points requests.")
+        parser.add_argument("--seed", type=int, default=0, help="Synthetic trace: random seed.")
+        parser.add_argument("--write-trace", metavar="PATH", help="Write the synthetic trace here instead of replaying it.")
+        parser.add_argument("--json", action="store_true", dest="as_json", help="Print the report as JSON.")
+        parser.add_argument("--max-error-rate", type=float, help="Exit non-zero if any endpoint's error rate is higher.")
+
+    def handle(self, *args, trace=None, url, mode, concurrency, speed, think_time, timeout, keep_alive, requests, rate, points_ratio,
+               seed, write_trace=None, as_json=False, max_error_rate=None, **options):
+        if trace is None:
+            requests_to_replay = synthetic_trace(requests, rate, points_ratio, seed)
+        else:
+            try:
+                with (sys.stdin if trace == "-" else open(trace)) as lines:
+                    requests_to_replay = read_trace(lines)
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+
+        if write_trace:
+            with open(write_trace, "w") as out:
+                for request in requests_to_replay:
+                    out.write(json.dumps(request) + "\n")
+            return
+
+        replay = Replay(requests_to_replay, url, timeout, keep_alive)
+        if mode == "open":
+            elapsed = replay.run_open_loop(concurrency, speed)
+        else:
+            elapsed = replay.run_closed_loop(concurrency, think_time)
+        report = replay.report(elapsed)
+
+        if as_json:
+            self.stdout.write(json.dumps({"elapsed_seconds": elapsed, "endpoints": report}))
+        else:
+            self.write_table(report, elapsed)
+
+        if max_error_rate is not None:
+            over = [endpoint for endpoint, stats in report.items() if stats["error_rate"] > max_error_rate]
+            if over:
+                raise CommandError(f"Error rate above {max_error_rate:.2%} for: {', '.join(over)}")
+
+    def write_table(self, report: dict, elapsed: float):
+        self.stdout.write(f"{len(report)} endpoint(s) in {elapsed:.2f}s")
+        self.stdout.write(
+            f"{'endpoint':>9} {'requests':>9} {'req/s':>8} {'errors':>7} "
+            f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8}  statuses"
+        )
+        for endpoint, stats in report.items():
+            statuses = " ".join(f"{status}:{count}" for status, count in stats["statuses"].items())
+            if stats["skipped"]:
+                statuses += f" skipped:{stats['skipped']}"
+            self.stdout.write(
+                f"{endpoint:>9} {stats['requests']:>9} {stats['throughput_rps']:>8.1f} {stats['error_rate']:>7.2%} "
+                f"{stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['p99.9_ms']:>9.2f} "
+                f"{stats['max_ms']:>8.2f}  {statuses}"
+            )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from receipts.models import Receipt, ScoringJob
+from receipts.routers import db_for_receipt_id, fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Move every receipt (and its items) onto the shard that owns it under the current "
+        "RECEIPTS_SHARD_COUNT. Run after changing the shard count; safe to re-run. "
+        "When shrinking, pass the SQLite files of the removed shards with --drain."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many receipts would move.")
+        parser.add_argument(
+            "--drain", action="append", default=[], metavar="PATH",
+            help="SQLite file of a shard that is no longer configured; all of its receipts are moved out.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, dry_run=False, drain=(), batch_size=500, **options):
+        def reshard(alias):
+            ids = Receipt.objects.using(alias).values_list("pk", flat=True).iterator(chunk_size=batch_size)
+            misplaced = [receipt_id for receipt_id in ids if db_for_receipt_id(receipt_id) != alias]
+            if not dry_run:
+                for receipt_id in misplaced:
+                    move_receipt(receipt_id, alias, db_for_receipt_id(receipt_id))
+            return alias, len(misplaced)
+
+        results = []
+        # drained files are done one at a time; they're rare and usually small
+        for index, path in enumerate(drain):
+            alias = f"reshard_drain_{index}"
+            connections.settings[alias] = {**connections.settings["default"], "NAME": path}
+            try:
+                results.append(reshard(alias))
+            finally:
+                connections[alias].close()
+        results.extend(fan_out(reshard))
+
+        verb = "would move" if dry_run else "moved"
+        for alias, moved in results:
+            self.stdout.write(f"{alias}: {verb} {moved} receipt(s)")
+
+
+def move_receipt(receipt_id: str, source: str, target: str):
+    receipt = Receipt.objects.using(source).get(pk=receipt_id)
+    items = list(receipt.item_set.all())
+    jobs = list(ScoringJob.objects.using(source).filter(pk=receipt_id))
+
+    # write the copy before deleting the original, so an interrupted run loses nothing
+    with transaction.atomic(using=target):
+        if not Receipt.objects.using(target).filter(pk=receipt_id).exists():
+            receipt.save(using=target, force_insert=True)
+            for item in items:
+                # item IDs are per-database autoincrements, so let the target assign new ones
+                item.pk = None
+            receipt.item_set.model.objects.using(target).bulk_create(items)
+            for job in jobs:
+                job.save(using=target, force_insert=True)
+
+    with transaction.atomic(using=source):
+        Receipt.objects.using(source).filter(pk=receipt_id).delete()
@@ -0,0 +1,70 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+
+def run_process(workers: int, poll_seconds: float, batch_size: int, drain: bool, stop):
+    # entry point of each worker process; sets Django up again under the spawn start method
+    import django
+
+    django.setup()
+    run_threads(workers, poll_seconds, batch_size, drain, stop)
+
+
+def run_threads(workers: int, poll_seconds: float, batch_size: int, drain: bool, stop):
+    # imported here: spawned children import this module before django.setup()
+    from receipts.scoring import run_worker
+
+    threads = [
+        threading.Thread(target=run_worker, args=(stop, poll_seconds, batch_size, drain), name=f"scoring-worker-{index}")
+        for index in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a pool of background scoring workers for receipts ingested with RECEIPTS_SCORING = 'background'. "
+        "Scoring is CPU-bound Python, so use --processes to scale with cores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes (default 1: run in this process).")
+        parser.add_argument("--threads", type=int, default=1, help="Worker threads per process.")
+        parser.add_argument("--poll-seconds", type=float, default=0.5, help="Sleep between polls when there's no work.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Jobs claimed per shard per poll.")
+        parser.add_argument("--drain", action="store_true", help="Exit once there are no jobs left.")
+
+    def handle(self, *args, processes=1, threads=1, poll_seconds=0.5, batch_size=100, drain=False, **options):
+        if processes == 1:
+            stop = threading.Event()
+            try:
+                run_threads(threads, poll_seconds, batch_size, drain, stop)
+            except KeyboardInterrupt:
+                stop.set()
+            return
+
+        import multiprocessing
+
+        from django.db import connections
+
+        # children must not share the parent's SQLite connections
+        connections.close_all()
+        context = multiprocessing.get_context("spawn")
+        stop = context.Event()
+        children = [
+            context.Process(target=run_process, args=(threads, poll_seconds, batch_size, drain, stop), name=f"scoring-process-{index}")
+            for index in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for child in children:
+                child.join()
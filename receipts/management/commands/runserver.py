@@ -0,0 +1,23 @@
+from django.contrib.staticfiles.management.commands.runserver import Command as StaticfilesRunserverCommand
+
+from mysite import startup
+
+
+class Command(StaticfilesRunserverCommand):
+    '''
+    runserver, minus the migration check with --skip-checks (the image is migrated at
+    build time, and the check walks the whole migration graph), and with a startup mark
+    once the server is listening.
+    '''
+
+    def handle(self, *args, **options):
+        self.skip_migration_check = options["skip_checks"]
+        super().handle(*args, **options)
+
+    def check_migrations(self):
+        if not self.skip_migration_check:
+            super().check_migrations()
+
+    def on_bind(self, server_port):
+        super().on_bind(server_port)
+        startup.mark(startup.LISTENING)
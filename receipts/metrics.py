@@ -0,0 +1,29 @@
+'''
+A tiny in-process metrics registry, served as JSON by the `metrics` view.
+
+Counters are incremented by the code paths they count. Gauges are callables that
+are evaluated when the metrics are read, so they cost nothing between scrapes.
+Values are per worker process.
+'''
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def register_gauge(name: str, func):
+    _gauges[name] = func
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+    gauges = {name: func() for name, func in _gauges.items()}
+    return {"counters": counters, "gauges": gauges}
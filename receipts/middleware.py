@@ -0,0 +1,94 @@
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import metrics
+
+
+INGEST = "ingest"
+READ = "read"
+
+ENDPOINT_CLASSES = {
+    "receipts:get_id_for_receipt": INGEST,
+    "receipts:points": READ,
+    "receipts:list_receipts": READ,
+}
+
+
+class AdmissionControlMiddleware:
+    '''
+    Load shedding for the receipts API, per worker process.
+
+    Ingests are bounded by RECEIPTS_MAX_INFLIGHT_INGESTS and wait at most
+    RECEIPTS_MAX_INGEST_QUEUE_SECONDS for a slot, so a burst queues briefly on this
+    worker instead of piling up on the SQLite write lock until clients time out.
+    Points reads are cheap and get their own, larger budget; they never queue behind
+    ingests, and while reads are saturating their budget ingests are shed first.
+    Anything over budget gets a fast 503 with Retry-After.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limits = {
+            INGEST: settings.RECEIPTS_MAX_INFLIGHT_INGESTS,
+            READ: settings.RECEIPTS_MAX_INFLIGHT_READS,
+        }
+        self.queue_seconds = settings.RECEIPTS_MAX_INGEST_QUEUE_SECONDS
+        self.retry_after = settings.RECEIPTS_RETRY_AFTER_SECONDS
+        self.ingest_slots = threading.BoundedSemaphore(self.limits[INGEST]) if self.limits[INGEST] else None
+        self.lock = threading.Lock()
+        self.inflight = {INGEST: 0, READ: 0}
+
+        for endpoint_class in self.inflight:
+            metrics.register_gauge(f"admission_inflight.{endpoint_class}", partial(self.inflight.get, endpoint_class))
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            release = getattr(request, "_admission_release", None)
+            if release is not None:
+                release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        endpoint_class = ENDPOINT_CLASSES.get(request.resolver_match.view_name)
+        if endpoint_class == INGEST and request.method == "POST":
+            admitted = self.admit_ingest()
+        elif endpoint_class == READ:
+            admitted = self.admit_read()
+        else:
+            return None
+
+        if not admitted:
+            metrics.incr(f"admission_shed.{endpoint_class}")
+            response = HttpResponse("The server is busy, retry later.", status=503)
+            response["Retry-After"] = str(self.retry_after)
+            return response
+
+        request._admission_release = lambda: self.release(endpoint_class)
+        return None
+
+    def admit_ingest(self) -> bool:
+        # reads have priority: don't add write-lock contention while they're saturated
+        if self.ingest_slots is None or self.inflight[READ] >= self.limits[READ]:
+            return False
+        if not self.ingest_slots.acquire(timeout=self.queue_seconds):
+            return False
+        with self.lock:
+            self.inflight[INGEST] += 1
+        return True
+
+    def admit_read(self) -> bool:
+        with self.lock:
+            if self.inflight[READ] >= self.limits[READ]:
+                return False
+            self.inflight[READ] += 1
+        return True
+
+    def release(self, endpoint_class: str):
+        with self.lock:
+            self.inflight[endpoint_class] -= 1
+        if endpoint_class == INGEST:
+            self.ingest_slots.release()
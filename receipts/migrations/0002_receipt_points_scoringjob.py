@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='points',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ScoringJob',
+            fields=[
+                ('receipt', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='receipts.receipt')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0002_receipt_points_scoringjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=1000),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='shortDescription',
+            field=models.CharField(max_length=1000),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0003_alter_item_price_alter_item_shortdescription'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['purchaseDate', 'hexadecimal_id'], name='receipt_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['retailer', 'purchaseDate', 'hexadecimal_id'], name='receipt_retailer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from decimal import ROUND_HALF_EVEN
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def convert_to_cents(apps, schema_editor):
+    '''
+    Fill in the new cents columns from the old DecimalFields, batch by batch in
+    primary key order. Values are read through the DecimalFields, so each receipt
+    keeps exactly the amount the app used to read (and score) for it.
+    '''
+    db = schema_editor.connection.alias
+    for model_name, dollars_field, cents_field in (("Receipt", "total", "total_cents"), ("Item", "price", "price_cents")):
+        model = apps.get_model("receipts", model_name)
+        queryset = model.objects.using(db).only("pk", dollars_field).order_by("pk")
+        last_pk = None
+        while True:
+            batch = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                cents = (getattr(row, dollars_field) * 100).to_integral_value(rounding=ROUND_HALF_EVEN)
+                setattr(row, cents_field, int(cents))
+            model.objects.using(db).bulk_update(batch, [cents_field])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0004_receipt_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='total_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='price_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        # irreversible: the dollar columns can't be added back as NOT NULL to populated tables
+        migrations.RunPython(convert_to_cents),
+        migrations.RemoveField(
+            model_name='receipt',
+            name='total',
+        ),
+        migrations.RemoveField(
+            model_name='item',
+            name='price',
+        ),
+        migrations.AlterField(
+            model_name='receipt',
+            name='total_cents',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='price_cents',
+            field=models.BigIntegerField(),
+        ),
+    ]
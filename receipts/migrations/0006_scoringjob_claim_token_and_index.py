@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0005_money_as_integer_cents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoringjob',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='scoringjob',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='scoringjob',
+            index=models.Index(fields=['claimed_at', 'created_at'], name='scoringjob_claim_idx'),
+        ),
+    ]
@@ -1,18 +1,156 @@
+import datetime
+from decimal import ROUND_HALF_EVEN, Context, Decimal, InvalidOperation
+
 from django.db import models
-import math
+from django.db.backends.signals import connection_created
+from django.db.models import Case, Count, F, Func, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractDay, Length
+from django.db.models.lookups import Exact
+from django.dispatch import receiver
 from .settings import DEBUG
 
+# every character str.strip() removes, so TRIM in SQL can remove the same ones. Spelled
+# out rather than found by scanning Unicode on every boot; a test checks it's complete
+WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+    "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+    "\u2028\u2029\u202f\u205f\u3000"
+)
+
+
+# 18 significant digits of cents fit in a BigIntegerField, and bound the work
+# a crafted amount like "1e999997" can cause to a constant
+MONEY_CONTEXT = Context(prec=18)
+CENT = Decimal("0.01")
+
+
+def dollars_to_cents(value) -> int:
+    '''
+    Parse a dollar amount such as "35.35" into integer cents. Fractions of a cent
+    are rounded half to even, as the DecimalFields that used to hold money did.
+    Raises ValueError for amounts that aren't finite numbers, or that don't fit in
+    18 digits of cents.
+    '''
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise ValueError(f"Invalid amount {value!r}")
+        # quantizing to more digits than the context's precision raises InvalidOperation
+        # before doing any arithmetic on them
+        return int(amount.quantize(CENT, rounding=ROUND_HALF_EVEN, context=MONEY_CONTEXT).scaleb(2))
+    except InvalidOperation as e:
+        raise ValueError(f"Invalid amount {value!r}") from e
+
+
+def cents_to_dollars(cents: int) -> str:
+    '''Format integer cents as a dollar amount, e.g. 3535 -> "35.35".'''
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02}"
+
+
+def to_python_fields(instance: models.Model):
+    '''
+    Convert the raw values an unsaved instance was built from (e.g. JSON strings)
+    into the Python values the database would hand back after saving it,
+    so that it can be scored without a round trip.
+    '''
+    for field in instance._meta.concrete_fields:
+        setattr(instance, field.attname, field.to_python(getattr(instance, field.attname)))
+
+
+def alnum_count(text):
+    return None if text is None else sum(c.isalnum() for c in text)
+
+
+@receiver(connection_created)
+def register_sql_functions(sender, connection, **kwargs):
+    if connection.vendor == "sqlite":
+        connection.connection.create_function("RECEIPTS_ALNUM_COUNT", 1, alnum_count, deterministic=True)
+
+
+class AlnumCount(Func):
+    '''
+    The number of alphanumeric characters in a string, as str.isalnum counts them.
+    SQLite has no Unicode character classes, so this one is a function registered on
+    every SQLite connection.
+    '''
+    function = "RECEIPTS_ALNUM_COUNT"
+    output_field = models.IntegerField()
+
+
+class TrimWhitespace(Func):
+    '''TRIM(expression, WHITESPACE): the SQL version of str.strip().'''
+    function = "TRIM"
+    output_field = models.CharField()
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, Value(WHITESPACE), **extra)
+
+
+class ReceiptQuerySet(models.QuerySet):
+
+    def with_points(self):
+        '''
+        Annotate every receipt with `computed_points`, the score get_points gives it,
+        computed by the database in the same query, items included. Each rule of
+        get_points has its counterpart below, in the same order.
+        '''
+        # SQLite's integer division truncates towards zero, which rounds negative prices up already
+        price_rounded_up = Case(
+            When(price_cents__gte=0, then=(F("price_cents") + 499) / 500),
+            default=F("price_cents") / 500,
+        )
+        item_points = (
+            Item.objects.filter(receipt=OuterRef("pk"))
+            .order_by()
+            .values("receipt")
+            .annotate(points=(
+                5 * (Count("pk") / 2)
+                + Sum(Case(When(Exact(Length(TrimWhitespace("shortDescription")) % 3, 0), then=price_rounded_up), default=0))
+            ))
+            .values("points")
+        )
+        return self.annotate(computed_points=(
+            AlnumCount("retailer")
+            + Case(When(Exact(F("total_cents") % 100, 0), then=50), default=0)
+            + Case(When(Exact(F("total_cents") % 25, 0), then=25), default=0)
+            # no row for receipts without items
+            + Coalesce(Subquery(item_points, output_field=models.IntegerField()), 0)
+            + Case(When(Exact(ExtractDay("purchaseDate") % 2, 1), then=6), default=0)
+            + Case(When(purchaseTime__gte=datetime.time(14), purchaseTime__lt=datetime.time(16), then=10), default=0)
+        ))
+
+
 class Receipt(models.Model):
     hexadecimal_id = models.CharField(max_length=36, primary_key=True) # e.g. c288fc46-3b6-8b4c-830d-77c75e9644e6
     retailer = models.CharField(max_length=100)
     purchaseDate = models.DateField()
     purchaseTime = models.TimeField()
-    total = models.DecimalField(max_digits=10, decimal_places=2)
+    # money is integer cents throughout; see dollars_to_cents and cents_to_dollars
+    total_cents = models.BigIntegerField()
+    # stored score; null until the receipt is scored (see receipts/scoring.py)
+    points = models.IntegerField(null=True, blank=True)
+
+    objects = ReceiptQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # newest-first keyset paging (receipts/pagination.py), and date range filters
+            models.Index(fields=["purchaseDate", "hexadecimal_id"], name="receipt_date_idx"),
+            # retailer lookups (exact or prefix), paged in the same order
+            models.Index(fields=["retailer", "purchaseDate", "hexadecimal_id"], name="receipt_retailer_date_idx"),
+        ]
 
     def __str__(self):
-            return f"{self.retailer} - {self.purchaseDate} - {self.purchaseTime} - {self.total}"
+            return f"{self.retailer} - {self.purchaseDate} - {self.purchaseTime} - {cents_to_dollars(self.total_cents)}"
 
-    def get_points(self):
+    def get_points(self, items=None):
+        '''
+        Compute this receipt's points. Pass `items` when they're already in memory
+        (e.g. during ingest) to skip loading them from the database.
+        '''
+        if items is None:
+            items = list(self.item_set.all())
         total_points = 0
         
         # One point for every alphanumeric character in the retailer name
@@ -23,31 +161,30 @@ class Receipt(models.Model):
             print(f"Total points after retailer name: {total_points}")
 
         # 50 points if the total is a round dollar amount with no cents.
-        if self.total == int(self.total):
+        if self.total_cents % 100 == 0:
             total_points += 50
         if DEBUG:
             print(f"Total points after if total a round dollar amount: {total_points}")
 
         # 25 points if the total is a multiple of 0.25.
-        self_total_as_int_times_100 = self.total * 100
-        # total / 0.25 being an int is equivalent to total*100 / 25 being an int
-        if self_total_as_int_times_100 / 25 == int(self_total_as_int_times_100 / 25):
+        if self.total_cents % 25 == 0:
             total_points += 25
         
         if DEBUG:
             print(f"Total points after if total is a multiple of 0.25: {total_points}")
 
         # 5 points for every two items on the receipt.
-        total_points += 5 * (self.item_set.count() // 2)
+        total_points += 5 * (len(items) // 2)
 
         if DEBUG:
             print(f"Total points after every two items: {total_points}")
 
         # If the trimmed length of the item description is a multiple of 3, multiply the price by 0.2 and round up to the nearest integer. The result is the number of points earned.
-        # multiplying the price by 0.2 is the same as dividing by 5
-        for item in self.item_set.all():
+        # multiplying the price by 0.2 is the same as dividing the price in cents by 500,
+        # and -(-a // b) is a / b rounded up
+        for item in items:
             if len(item.shortDescription.strip()) % 3 == 0:
-                total_points += math.ceil(item.price / 5)
+                total_points += -(-item.price_cents // 500)
         if DEBUG:
             print(f"Total points after if trimmed len is multiple of 3: {total_points}")
         
@@ -68,9 +205,31 @@ class Receipt(models.Model):
 class Item(models.Model):
     receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE)
     shortDescription = models.CharField(max_length=1000)
-    price = models.DecimalField(max_digits=1000, decimal_places=2)
+    price_cents = models.BigIntegerField()
 
     def __str__(self):
-        return f"{self.shortDescription} - {self.price} - {self.receipt.hexadecimal_id}"
+        # receipt_id is the receipt's hexadecimal_id; going through self.receipt would load the receipt
+        return f"{self.shortDescription} - {cents_to_dollars(self.price_cents)} - {self.receipt_id}"
 
 
+class ScoringJob(models.Model):
+    '''
+    A receipt waiting to be scored by the background workers (run_scoring_workers).
+    Lives on the same shard as its receipt and is deleted once the score is stored.
+    '''
+    receipt = models.OneToOneField(Receipt, on_delete=models.CASCADE, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # set when a worker claims the job; a claim older than the lease can be taken over
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # unique per claim, so a worker can read back which jobs its claim took
+    claim_token = models.CharField(max_length=32, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # unclaimed (or expired) jobs, oldest first, without sorting the backlog
+            models.Index(fields=["claimed_at", "created_at"], name="scoringjob_claim_idx"),
+        ]
+
+    def __str__(self):
+        return f"Scoring job for {self.receipt_id}"
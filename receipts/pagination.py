@@ -0,0 +1,73 @@
+'''
+Keyset ("seek") pagination over receipts, newest purchase date first.
+
+Offset pagination makes the database walk past every row before the requested page,
+so deep pages get slower as the table grows. A keyset page instead resumes right after
+the last row of the previous page, which the (purchaseDate, hexadecimal_id) index
+serves as a range scan however deep the page is.
+
+Cursors are opaque to clients: the sort key of the last row of a page, JSON-encoded
+in URL-safe base64.
+'''
+import base64
+import datetime
+import json
+from itertools import chain
+
+from django.db.models import Q
+
+# hexadecimal_id breaks ties between receipts from the same day, so the order is total
+KEYSET_ORDERING = ("-purchaseDate", "-hexadecimal_id")
+
+
+def sort_key(receipt) -> tuple[datetime.date, str]:
+    return receipt.purchaseDate, receipt.hexadecimal_id
+
+
+def encode_cursor(receipt) -> str:
+    raw = json.dumps([receipt.purchaseDate.isoformat(), receipt.hexadecimal_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.date, str]:
+    '''The sort key in `cursor`. Raises ValueError for anything that isn't a cursor.'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        purchase_date, receipt_id = json.loads(raw)
+        return datetime.date.fromisoformat(purchase_date), str(receipt_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def after_cursor(cursor: str) -> Q:
+    '''The receipts that come after the one `cursor` points at, in KEYSET_ORDERING.'''
+    purchase_date, receipt_id = decode_cursor(cursor)
+    # the leading purchaseDate <= bound is implied by the rest, but SQLite can only seek the
+    # index to a bound outside an OR; without it, every row before the cursor is scanned
+    return Q(purchaseDate__lte=purchase_date) & (Q(purchaseDate__lt=purchase_date) | Q(hexadecimal_id__lt=receipt_id))
+
+
+def keyset_page(queryset, cursor: str | None, page_size: int) -> tuple[list, str | None]:
+    '''
+    One page of `queryset` in KEYSET_ORDERING, starting after `cursor` (or at the
+    beginning), and the cursor of the next page, or None on the last page.
+    '''
+    queryset = queryset.order_by(*KEYSET_ORDERING)
+    if cursor:
+        queryset = queryset.filter(after_cursor(cursor))
+    # one extra row tells whether there's a next page, without counting
+    rows = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def merge_pages(pages: list[tuple[list, str | None]], page_size: int) -> tuple[list, str | None]:
+    '''
+    Merge `keyset_page` results from several shards, all taken after the same cursor,
+    into one page of the combined ordering. Every shard contributed its first
+    `page_size` rows, so the first `page_size` of their union are the right ones.
+    '''
+    rows = sorted(chain.from_iterable(rows for rows, _ in pages), key=sort_key, reverse=True)
+    has_more = len(rows) > page_size or any(next_cursor is not None for _, next_cursor in pages)
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1]) if has_more else None
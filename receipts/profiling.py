@@ -0,0 +1,191 @@
+'''
+On-demand request profiling, for finding where the time goes in a slow view.
+
+With RECEIPTS_PROFILING on, ProfilingMiddleware profiles a request when it carries
+`X-Receipts-Profile: <RECEIPTS_PROFILING_TOKEN>`, or when it is among the
+RECEIPTS_PROFILING_SAMPLE_RATE of requests picked at random. The view runs under
+cProfile, and every SQL statement it runs is timed. Each profile holds the
+TOP_FUNCTIONS functions with the most cumulative time, plus every function of this
+app (get_points is rarely among the slowest), each with its callers, so they show up
+where they were called from. It also holds the SQL timeline.
+
+The last RECEIPTS_PROFILING_MAX_PROFILES profiles are kept in memory, per worker
+process. Staff users can read them at /receipts/profiles. A profiled response
+carries the ID of its profile in X-Receipts-Profile-Id.
+'''
+import hmac
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from . import metrics
+from .query_budget import QueryRecorder
+
+PROFILE_HEADER = "X-Receipts-Profile"
+PROFILE_ID_HEADER = "X-Receipts-Profile-Id"
+# how many functions a profile keeps, by cumulative time, besides this app's own
+TOP_FUNCTIONS = 50
+APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+# reading profiles shouldn't push them out of the ring
+UNPROFILED_VIEWS = {"receipts:profiles", "receipts:profile"}
+
+_lock = threading.Lock()
+_profiles = deque()
+_ids = itertools.count(1)
+
+
+def record(profile: dict) -> int:
+    '''Add `profile` to the ring, dropping the oldest ones over the limit, and return its ID.'''
+    with _lock:
+        profile["id"] = next(_ids)
+        _profiles.append(profile)
+        while len(_profiles) > settings.RECEIPTS_PROFILING_MAX_PROFILES:
+            _profiles.popleft()
+    return profile["id"]
+
+
+def recent() -> list[dict]:
+    '''The profiles in the ring, newest first.'''
+    with _lock:
+        return list(reversed(_profiles))
+
+
+def get(profile_id: int) -> dict | None:
+    with _lock:
+        return next((profile for profile in _profiles if profile["id"] == profile_id), None)
+
+
+def clear():
+    with _lock:
+        _profiles.clear()
+
+
+class SQLTimeline(QueryRecorder):
+    '''A QueryRecorder that also records the database each statement ran on, and when it ran.'''
+
+    def __init__(self, start: float):
+        super().__init__()
+        self.start = start
+        self.timeline = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timeline.append({
+                "database": context["connection"].alias,
+                "sql": sql,
+                "start_ms": (started - self.start) * 1000,
+                "duration_ms": (time.perf_counter() - started) * 1000,
+            })
+
+
+def call_tree(profiler) -> list[dict]:
+    '''
+    The TOP_FUNCTIONS functions with the most cumulative time and this app's functions,
+    by cumulative time, and what called them.
+    '''
+    import pstats  # not imported at boot, as in ProfilingMiddleware.process_view
+
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda row: row[1][3], reverse=True)
+    rows = [row for rank, row in enumerate(rows) if rank < TOP_FUNCTIONS or row[0][0].startswith(APP_DIR)]
+    return [
+        {
+            "function": pstats.func_std_string(function),
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "own_ms": own_time * 1000,
+            "cumulative_ms": cumulative_time * 1000,
+            "callers": sorted(pstats.func_std_string(caller) for caller in callers),
+        }
+        for function, (primitive_calls, calls, own_time, cumulative_time, callers) in rows
+    ]
+
+
+class ProfilingMiddleware:
+    '''
+    Profiles the view of a request picked by the header or by sampling (see above).
+    It must be last in MIDDLEWARE, so that its profiles cover the view only.
+
+    The middleware is only installed when RECEIPTS_PROFILING is on, so requests pay
+    nothing for it otherwise. When it's on, a request that isn't picked costs a
+    header lookup and a random number.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.RECEIPTS_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.RECEIPTS_PROFILING_SAMPLE_RATE
+        self.token = settings.RECEIPTS_PROFILING_TOKEN.encode("utf-8")
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, "_profiling", None)
+        if session is None:
+            return response
+
+        trigger, started_at, start, profiler, timeline, stack = session
+        profiler.disable()
+        duration = time.perf_counter() - start
+        stack.close()
+
+        profile_id = record({
+            "method": request.method,
+            "path": request.path,
+            "view": request.resolver_match.view_name,
+            "status": response.status_code,
+            "trigger": trigger,
+            "started_at": started_at.isoformat(),
+            "duration_ms": duration * 1000,
+            "query_count": len(timeline.timeline),
+            "sql_ms": sum(query["duration_ms"] for query in timeline.timeline),
+            "functions": call_tree(profiler),
+            "sql": timeline.timeline,
+        })
+        metrics.incr(f"profiles_captured.{trigger}")
+        response[PROFILE_ID_HEADER] = str(profile_id)
+        return response
+
+    def trigger(self, request) -> str | None:
+        '''Why this request should be profiled, or None if it shouldn't.'''
+        header = request.headers.get(PROFILE_HEADER)
+        if header is not None and self.token and hmac.compare_digest(header.encode("utf-8"), self.token):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        trigger = self.trigger(request)
+        if trigger is None or request.resolver_match.view_name in UNPROFILED_VIEWS:
+            return None
+
+        # imported here: this module is loaded at every boot, profiling on or not
+        import cProfile
+
+        start = time.perf_counter()
+        timeline = SQLTimeline(start)
+        stack = ExitStack()
+        stack.enter_context(timeline.recording())
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # from Python 3.12 only one profiler can run at a time, and another request has it
+            stack.close()
+            metrics.incr("profiles_skipped")
+            return None
+        request._profiling = (trigger, timezone.now(), start, profiler, timeline, stack)
+        return None
@@ -0,0 +1,144 @@
+'''
+Per-view query budgets.
+
+A view declares the most SQL statements it may run per request with `@query_budget(n)`.
+The budget is a constant: it must hold however many items a receipt has, so a view
+whose query count grows with its input (an N+1) blows it. The one allowance is for
+bulk writes, which the database takes in batches of limited size: a view declared with
+`batch_size` may run one more query per batch after the first, for the number of rows
+it reports with `note_batched_rows`.
+
+Budgets are enforced in tests with QueryBudgetTestMixin.assertWithinQueryBudget, and
+optionally watched in production by QueryBudgetMiddleware, which logs and counts
+requests over budget together with fingerprints of the SQL they ran.
+'''
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import reverse, resolve
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(max_queries: int, per_shard: bool = False, batch_size: int | None = None):
+    '''
+    With `per_shard`, the view may run `max_queries` on each of the RECEIPTS_SHARD_COUNT shards.
+    With `batch_size`, it may also run one query per `batch_size` rows it writes in bulk,
+    past the first batch.
+    '''
+    def decorator(view):
+        view.query_budget = max_queries
+        view.query_budget_per_shard = per_shard
+        view.query_budget_batch_size = batch_size
+        return view
+    return decorator
+
+
+def note_batched_rows(request, rows: int):
+    '''Report how many rows the view is writing in bulk, for its `batch_size` allowance.'''
+    request.query_budget_batched_rows = rows
+
+
+def get_query_budget(view, batched_rows: int = 0) -> int | None:
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        return None
+    if getattr(view, "query_budget_per_shard", False):
+        budget *= settings.RECEIPTS_SHARD_COUNT
+    batch_size = getattr(view, "query_budget_batch_size", None)
+    if batch_size and batched_rows > batch_size:
+        budget += -(-batched_rows // batch_size) - 1
+    return budget
+
+
+_PLACEHOLDER_GROUPS = re.compile(r"\((?:%s|\?)(?:,\s*(?:%s|\?))*\)(?:,\s*\((?:%s|\?)(?:,\s*(?:%s|\?))*\))*")
+_STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql: str) -> str:
+    '''
+    SQL with its literals and placeholder lists collapsed, so that the same statement
+    run with different values (or a different number of IN/VALUES entries) reads the same.
+    '''
+    sql = _STRING_LITERALS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    return _PLACEHOLDER_GROUPS.sub("(...)", sql)
+
+
+class QueryRecorder:
+    '''
+    Records every statement run on any database connection of the current thread,
+    including transaction control like BEGIN.
+    '''
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def recording(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def fingerprints(self) -> list[tuple[str, int]]:
+        return Counter(fingerprint(sql) for sql in self.queries).most_common()
+
+    def describe(self) -> str:
+        return "\n".join(f"  {count}x {sql}" for sql, count in self.fingerprints())
+
+
+class QueryBudgetTestMixin:
+    @contextmanager
+    def assertWithinQueryBudget(self, url_name: str, *args, batched_rows: int = 0):
+        view = resolve(reverse(url_name, args=args)).func
+        budget = get_query_budget(view, batched_rows)
+        self.assertIsNotNone(budget, f"{url_name} doesn't declare a query budget")
+
+        recorder = QueryRecorder()
+        with recorder.recording():
+            yield recorder
+        self.assertLessEqual(
+            len(recorder.queries), budget,
+            f"{url_name} ran {len(recorder.queries)} queries, over its budget of {budget}:\n{recorder.describe()}",
+        )
+
+
+class QueryBudgetMiddleware:
+    '''
+    Logs a warning, and counts `query_budget_exceeded.<view name>`, for every request whose
+    view ran more queries than its budget. Only installed when RECEIPTS_QUERY_BUDGET_WARNINGS
+    is on, since recording every statement isn't free.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.RECEIPTS_QUERY_BUDGET_WARNINGS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.recording():
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        budget = get_query_budget(match.func, getattr(request, "query_budget_batched_rows", 0)) if match is not None else None
+        if budget is not None and len(recorder.queries) > budget:
+            metrics.incr(f"query_budget_exceeded.{match.view_name}")
+            logger.warning(
+                "%s %s ran %d queries, over the %s budget of %d:\n%s",
+                request.method, request.path, len(recorder.queries), match.view_name, budget, recorder.describe(),
+            )
+        return response
@@ -0,0 +1,129 @@
+'''
+Snapshot read replicas, one per shard.
+
+A replica is a plain SQLite file that is periodically overwritten with a consistent
+copy of its primary using SQLite's online backup API. Readers of the replica never
+wait on ingest's write lock. The copy is refreshed every RECEIPTS_REPLICA_REFRESH_SECONDS
+by a background thread in a serving process (or by `manage.py refresh_replicas`
+from cron), and its age is exposed as the `replica_lag_seconds.<alias>` gauge.
+
+Every serving process runs the refresher thread, but only the one holding a replica's
+refresh lock (an flock on a file next to the replica) copies it; the others keep
+trying the lock, so one of them takes over if the holder exits. Without it, N worker
+processes would each overwrite the replica every interval.
+'''
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .routers import replica_alias, replica_is_primary, shard_aliases
+
+logger = logging.getLogger(__name__)
+
+_refresher = None
+_refresher_lock = threading.Lock()
+# the open lock files of the replicas this process refreshes, by shard alias
+_refresh_locks = {}
+
+
+def copy_database(primary_path, replica_path, timeout: float = 20):
+    # backup() copies a transactionally consistent snapshot page by page,
+    # and takes the replica's write lock so readers never see a torn copy
+    source = sqlite3.connect(primary_path, timeout=timeout)
+    target = sqlite3.connect(replica_path, timeout=timeout)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def replica_path(alias: str) -> str:
+    return str(connections[replica_alias(alias)].settings_dict["NAME"])
+
+
+def refresh_replica(alias: str):
+    if replica_is_primary(alias):
+        return
+    primary_path = connections[alias].settings_dict["NAME"]
+    copy_database(primary_path, replica_path(alias), connections[alias].settings_dict["OPTIONS"].get("timeout", 20))
+    metrics.incr("replica_refreshes")
+
+
+def replica_lag_seconds(alias: str) -> float | None:
+    '''Age of the replica's snapshot, or None when there's no snapshot yet.'''
+    try:
+        return time.time() - os.path.getmtime(replica_path(alias))
+    except OSError:
+        return None
+
+
+def try_lock(path: str) -> int | None:
+    '''
+    Take an exclusive flock on `path` without waiting, and return the open file
+    descriptor that holds it, or None if another open file holds it already.
+    '''
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def is_refresher(alias: str) -> bool:
+    '''Whether this process refreshes `alias`'s replica; takes the refresh lock when it's free.'''
+    if alias not in _refresh_locks:
+        fd = try_lock(replica_path(alias) + ".refresh-lock")
+        if fd is None:
+            return False
+        # held until the process exits
+        _refresh_locks[alias] = fd
+    return True
+
+
+def refresh_all(initial: bool = False):
+    '''
+    Refresh the replicas this process holds the refresh lock for. With `initial`, also
+    take a first snapshot of replicas that don't have one yet, whoever refreshes them.
+    '''
+    for alias in shard_aliases():
+        if replica_is_primary(alias):
+            continue
+        try:
+            if is_refresher(alias) or (initial and replica_lag_seconds(alias) is None):
+                refresh_replica(alias)
+        except Exception:
+            metrics.incr("replica_refresh_errors")
+            logger.exception("Failed to refresh the replica of %s", alias)
+
+
+def _refresh_forever():
+    while True:
+        time.sleep(settings.RECEIPTS_REPLICA_REFRESH_SECONDS)
+        refresh_all()
+
+
+def ensure_refresher_started():
+    '''
+    Start this process's refresher thread on first use. The first call also takes
+    a snapshot synchronously when this process is the refresher or there's no
+    snapshot yet, so a fresh deployment never reads an empty replica.
+    '''
+    global _refresher
+    if _refresher is not None:
+        return
+    with _refresher_lock:
+        if _refresher is not None:
+            return
+        refresh_all(initial=True)
+        _refresher = threading.Thread(target=_refresh_forever, name="replica-refresher", daemon=True)
+        _refresher.start()
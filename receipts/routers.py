@@ -0,0 +1,126 @@
+import zlib
+
+from django.conf import settings
+from django.db import connections
+
+
+# Number of leading characters of a receipt ID that pick its shard.
+# Receipt IDs are random hex, so the first 8 characters are well distributed.
+SHARD_KEY_LENGTH = 8
+
+
+def shard_alias(shard: int) -> str:
+    # shard 0 lives in 'default' so a single-shard install is just the plain database
+    return 'default' if shard == 0 else f'shard_{shard}'
+
+
+def shard_aliases() -> list[str]:
+    return [shard_alias(shard) for shard in range(settings.RECEIPTS_SHARD_COUNT)]
+
+
+def replica_alias(alias: str) -> str:
+    return f"{alias}_replica"
+
+
+def replica_is_primary(alias: str) -> bool:
+    # true when the replica is configured as (or, under tests, mirrors) the primary itself
+    replica_name = connections[replica_alias(alias)].settings_dict["NAME"]
+    return str(replica_name) == str(connections[alias].settings_dict["NAME"])
+
+
+def shard_for_receipt_id(receipt_id: str, shard_count: int | None = None) -> int:
+    if shard_count is None:
+        shard_count = settings.RECEIPTS_SHARD_COUNT
+    return zlib.crc32(receipt_id[:SHARD_KEY_LENGTH].encode("utf-8")) % shard_count
+
+
+def read_db(alias: str) -> str:
+    '''
+    The database to serve read-only traffic for shard `alias` from: its snapshot
+    replica (see receipts/replicas.py) when RECEIPTS_READ_REPLICA is on, else itself.
+    '''
+    if settings.RECEIPTS_READ_REPLICA and not replica_is_primary(alias):
+        from .replicas import ensure_refresher_started
+
+        ensure_refresher_started()
+        return replica_alias(alias)
+    return alias
+
+
+def db_for_receipt_id(receipt_id: str, for_read: bool = False) -> str:
+    '''
+    The database holding `receipt_id`. Pass `for_read=True` for read-only traffic
+    that may be served from the shard's snapshot replica (see `read_db`);
+    callers must fall back to the primary when the receipt isn't in the snapshot yet.
+    '''
+    alias = shard_alias(shard_for_receipt_id(receipt_id))
+    return read_db(alias) if for_read else alias
+
+
+def fan_out(func) -> list:
+    '''
+    Call `func(alias)` once per shard, in parallel when there's more than one shard,
+    and return the results in shard order.
+    '''
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return [func(aliases[0])]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def call_and_close(alias):
+        # each worker thread opens its own connections; don't leak them
+        try:
+            return func(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+        return list(executor.map(call_and_close, aliases))
+
+
+class ReceiptShardRouter:
+    '''
+    Routes every model of the receipts app to the shard that owns its receipt ID.
+    Everything else (auth, admin, sessions, ...) stays on 'default'.
+
+    Lookups by primary key carry no instance hint, so callers that only have a
+    receipt ID should select the shard explicitly with `db_for_receipt_id`. The same
+    goes for `Receipt.objects.create()`: the router never sees the new instance, so
+    without `.using(db_for_receipt_id(...))` the receipt lands on 'default' whatever
+    shard owns its ID.
+    '''
+
+    app_label = "receipts"
+
+    def _db_for_instance(self, instance):
+        if instance is None or instance._meta.app_label != self.app_label:
+            return None
+        # an instance that was loaded from (or saved to) a database stays there,
+        # e.g. while reshard_receipts is copying it between shards
+        if instance._state.db is not None:
+            return instance._state.db
+        receipt_id = getattr(instance, "receipt_id", None) or instance.pk
+        if not receipt_id:
+            return None
+        return db_for_receipt_id(receipt_id)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        return self._db_for_instance(hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        return self._db_for_instance(hints.get("instance"))
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == "default":
+            return None
+        if db in {replica_alias(alias) for alias in shard_aliases()}:
+            # replicas are byte-for-byte snapshots of their primary, schema included
+            return False
+        if db in shard_aliases():
+            return app_label == self.app_label
+        return None
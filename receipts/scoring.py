@@ -0,0 +1,94 @@
+'''
+Background scoring workers.
+
+With RECEIPTS_SCORING = 'background', ingest stores a ScoringJob next to each new
+receipt instead of scoring it. Workers claim jobs from every shard, compute the
+points, store them on the receipt and delete the job, all in one transaction.
+A claim is a lease: if a worker dies mid-job, another one takes the job over once
+the lease has expired, so a receipt is scored at least once.
+'''
+import datetime
+import logging
+import uuid
+
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Receipt, ScoringJob
+from .routers import shard_aliases
+
+logger = logging.getLogger(__name__)
+
+LEASE = datetime.timedelta(seconds=60)
+
+
+def claim_jobs(db: str, limit: int) -> list[str]:
+    '''
+    Claim up to `limit` jobs on `db` and return their receipt IDs: unclaimed jobs oldest
+    first, then jobs whose lease has expired. Each kind is read in the order of the
+    (claimed_at, created_at) index, so a poll never sorts the backlog.
+    '''
+    now = timezone.now()
+    jobs = ScoringJob.objects.using(db)
+    token = uuid.uuid4().hex
+    claimed = 0
+    for waiting, order in ((Q(claimed_at__isnull=True), "created_at"), (Q(claimed_at__lt=now - LEASE), "claimed_at")):
+        # a read first, so that idle polls don't take the shard's write lock
+        if claimed == limit or not jobs.filter(waiting).exists():
+            continue
+        # one UPDATE claims the batch; SQLite picks the batch while holding the
+        # write lock, so concurrent workers can't claim the same job
+        batch = jobs.filter(waiting).order_by(order).values("pk")[:limit - claimed]
+        claimed += jobs.filter(pk__in=batch).update(claimed_at=now, claim_token=token, attempts=F("attempts") + 1)
+    if not claimed:
+        return []
+    return list(jobs.filter(claimed_at=now, claim_token=token).order_by("created_at").values_list("pk", flat=True))
+
+
+def score_receipts(db: str, receipt_ids: list[str]):
+    receipts = list(Receipt.objects.using(db).filter(pk__in=receipt_ids).prefetch_related("item_set"))
+    for receipt in receipts:
+        receipt.points = receipt.get_points(list(receipt.item_set.all()))
+    # one commit per batch rather than per receipt
+    with transaction.atomic(using=db):
+        Receipt.objects.using(db).bulk_update(receipts, ["points"])
+        ScoringJob.objects.using(db).filter(pk__in=receipt_ids).delete()
+    metrics.incr("scoring_jobs_completed", len(receipts))
+
+
+def run_once(batch_size: int = 100) -> int:
+    '''Claim and score one batch from every shard. Returns how many receipts were scored.'''
+    scored = 0
+    # shard by shard rather than through fan_out: run_scoring_workers already runs
+    # several of these loops at once, each with its own connections
+    for db in shard_aliases():
+        receipt_ids = claim_jobs(db, batch_size)
+        if not receipt_ids:
+            continue
+        try:
+            score_receipts(db, receipt_ids)
+        except Exception:
+            # leave the jobs claimed; they're retried once the lease expires
+            metrics.incr("scoring_jobs_failed", len(receipt_ids))
+            logger.exception("Failed to score receipts %s on %s", receipt_ids, db)
+        else:
+            scored += len(receipt_ids)
+    return scored
+
+
+def run_worker(stop, poll_seconds: float = 0.5, batch_size: int = 100, drain: bool = False):
+    '''
+    Score jobs until `stop` (a threading or multiprocessing Event) is set. Sleeps
+    `poll_seconds` whenever no shard has work. With `drain`, returns as soon as
+    there's no work left instead.
+    '''
+    try:
+        while not stop.is_set():
+            if not run_once(batch_size):
+                if drain:
+                    return
+                stop.wait(poll_seconds)
+    finally:
+        connections.close_all()
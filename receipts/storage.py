@@ -0,0 +1,249 @@
+'''
+Receipt storage backends used by the views.
+
+RECEIPTS_STORAGE_BACKEND picks one by dotted path:
+
+- ORMReceiptStore (default): the Receipt/Item models in the sharded SQLite databases,
+  with optional read replicas and background scoring.
+- InMemoryReceiptStore: a process-local store for deployments that only need receipts
+  for a short window. Nothing survives a restart, every worker process has its own
+  receipts, and the oldest receipts are evicted once the size cap is reached.
+
+Backends receive receipts as unsaved Receipt and Item instances whose fields have been
+converted with `to_python_fields`, so that both backends validate input identically.
+'''
+import datetime
+import heapq
+import random
+import threading
+from collections import OrderedDict, defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Item, Receipt, ScoringJob
+from .pagination import decode_cursor, encode_cursor, keyset_page, merge_pages
+from .routers import db_for_receipt_id, read_db, shard_aliases
+
+
+# items per INSERT; at three columns each, a batch stays under SQLite's 999 query parameters
+ITEM_INSERT_BATCH_SIZE = 300
+
+
+def get_random_hexadecimal_id() -> str:
+    randint_1 = random.randint(0, 16**8-1)
+    randint_2 = random.randint(0, 16**4-1)
+    randint_3 = random.randint(0, 16**4-1)
+    randint_4 = random.randint(0, 16**4-1)
+    randint_5 = random.randint(0, 16**12-1)
+
+    return '-'.join([hex(randint_1)[2:], hex(randint_2)[2:], hex(randint_3)[2:], hex(randint_4)[2:], hex(randint_5)[2:]])
+
+
+class ReceiptStore:
+    def add(self, receipt: Receipt, items: list[Item]) -> str:
+        '''Store a new receipt with its items under a fresh ID, and return the ID.'''
+        raise NotImplementedError
+
+    def get_points(self, receipt_id: str) -> int | None:
+        '''
+        The receipt's points, or None while the receipt is queued for background
+        scoring and RECEIPTS_PENDING_POINTS_RESPONSE is 'accepted'.
+        Raises Receipt.DoesNotExist for unknown IDs.
+        '''
+        raise NotImplementedError
+
+    def list_receipts(self, cursor: str | None, limit: int, retailer: str | None = None,
+                      purchased_from: datetime.date | None = None, purchased_to: datetime.date | None = None,
+                      include_points: bool = False) -> tuple[list[Receipt], str | None]:
+        '''
+        One page of receipts, newest purchase date first (see receipts/pagination.py),
+        and the cursor of the next page. With `include_points`, every receipt's
+        points are filled in. Raises NotImplementedError if the backend can't list.
+        '''
+        raise NotImplementedError
+
+
+class ORMReceiptStore(ReceiptStore):
+    def add(self, receipt: Receipt, items: list[Item]) -> str:
+        random_hex_id = get_random_hexadecimal_id()
+        # in the (very!) unlikely case of a collision, regenerate the ID until it's unique
+        while Receipt.objects.using(db_for_receipt_id(random_hex_id)).filter(pk=random_hex_id).exists():
+            random_hex_id = get_random_hexadecimal_id()
+        db = db_for_receipt_id(random_hex_id)
+
+        receipt.hexadecimal_id = random_hex_id
+        for item in items:
+            item.receipt = receipt
+
+        if settings.RECEIPTS_SCORING == "inline":
+            # everything is already in memory, so scoring here costs no queries
+            receipt.points = receipt.get_points(items)
+
+        # the receipt and its items live on the same shard; don't leave a half-written receipt behind
+        with transaction.atomic(using=db):
+            receipt.save(using=db, force_insert=True)
+            Item.objects.using(db).bulk_create(items, batch_size=ITEM_INSERT_BATCH_SIZE)
+            if receipt.points is None:
+                ScoringJob.objects.using(db).create(receipt=receipt)
+        return random_hex_id
+
+    def get_receipt(self, receipt_id: str) -> Receipt:
+        db = db_for_receipt_id(receipt_id, for_read=True)
+        try:
+            return Receipt.objects.using(db).get(pk=receipt_id)
+        except Receipt.DoesNotExist:
+            primary = db_for_receipt_id(receipt_id)
+            if db == primary:
+                raise
+            # the replica snapshot may predate this receipt; only the primary can say it doesn't exist
+            metrics.incr("replica_fallback_reads")
+            return Receipt.objects.using(primary).get(pk=receipt_id)
+
+    def get_points(self, receipt_id: str) -> int | None:
+        receipt = self.get_receipt(receipt_id)
+        if receipt.points is not None:
+            return receipt.points
+        if settings.RECEIPTS_PENDING_POINTS_RESPONSE == "accepted" and ScoringJob.objects.using(receipt._state.db).filter(pk=receipt_id).exists():
+            return None
+        # not scored yet (or stored before points were), so score it now
+        return receipt.get_points()
+
+    def list_receipts(self, cursor, limit, retailer=None, purchased_from=None, purchased_to=None, include_points=False):
+        filters = Q()
+        if retailer is not None:
+            filters &= Q(retailer=retailer)
+        if purchased_from is not None:
+            filters &= Q(purchaseDate__gte=purchased_from)
+        if purchased_to is not None:
+            filters &= Q(purchaseDate__lte=purchased_to)
+        # the same cursor applies to every shard, so each one serves its own keyset page.
+        # Not fan_out: a page is one short indexed query per shard, which costs less than
+        # starting threads and opening a connection per shard for every request
+        pages = [keyset_page(Receipt.objects.using(read_db(alias)).filter(filters), cursor, limit) for alias in shard_aliases()]
+        receipts, next_cursor = merge_pages(pages, limit)
+
+        if include_points:
+            unscored = defaultdict(list)
+            for receipt in receipts:
+                if receipt.points is None:
+                    unscored[receipt._state.db].append(receipt)
+            for shard_receipts in unscored.values():
+                # one query per shard for the items of every receipt on the page that needs scoring
+                prefetch_related_objects(shard_receipts, "item_set")
+                for receipt in shard_receipts:
+                    receipt.points = receipt.get_points()
+        return receipts, next_cursor
+
+
+class ReceiptRecord:
+    # one of these per stored receipt, so keep it compact
+    __slots__ = ("retailer", "purchaseDate", "purchaseTime", "total_cents", "points")
+
+    def __init__(self, retailer, purchaseDate, purchaseTime, total_cents, points):
+        self.retailer = retailer
+        self.purchaseDate = purchaseDate
+        self.purchaseTime = purchaseTime
+        self.total_cents = total_cents
+        self.points = points
+
+
+class InMemoryReceiptStore(ReceiptStore):
+    '''
+    Receipts in RECEIPTS_MEMORY_STRIPES dicts, each behind its own lock, so concurrent
+    requests rarely wait on each other. Points are computed once, on ingest; items
+    aren't kept. Each stripe holds at most its share of RECEIPTS_MEMORY_MAX_RECEIPTS
+    and evicts its oldest receipts first. Listing has no index to use, so every page
+    filters all the receipts held, which the size cap bounds.
+    '''
+
+    def __init__(self):
+        self.stripe_count = settings.RECEIPTS_MEMORY_STRIPES
+        self.stripe_capacity = max(1, settings.RECEIPTS_MEMORY_MAX_RECEIPTS // self.stripe_count)
+        self.locks = [threading.Lock() for _ in range(self.stripe_count)]
+        self.stripes = [OrderedDict() for _ in range(self.stripe_count)]
+        metrics.register_gauge("memory_store_receipts", self.__len__)
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self.stripes)
+
+    def stripe_index(self, receipt_id: str) -> int:
+        return hash(receipt_id) % self.stripe_count
+
+    def add(self, receipt: Receipt, items: list[Item]) -> str:
+        record = ReceiptRecord(receipt.retailer, receipt.purchaseDate, receipt.purchaseTime, receipt.total_cents, receipt.get_points(items))
+        while True:
+            random_hex_id = get_random_hexadecimal_id()
+            index = self.stripe_index(random_hex_id)
+            with self.locks[index]:
+                stripe = self.stripes[index]
+                # in the (very!) unlikely case of a collision, regenerate the ID until it's unique
+                if random_hex_id in stripe:
+                    continue
+                stripe[random_hex_id] = record
+                evicted = len(stripe) - self.stripe_capacity
+                for _ in range(evicted):
+                    stripe.popitem(last=False)
+            if evicted > 0:
+                metrics.incr("memory_store_evictions", evicted)
+            return random_hex_id
+
+    def get_record(self, receipt_id: str) -> ReceiptRecord:
+        # a single dict lookup is atomic under the GIL, so reads don't take the stripe lock
+        record = self.stripes[self.stripe_index(receipt_id)].get(receipt_id)
+        if record is None:
+            raise Receipt.DoesNotExist(f"No receipt {receipt_id}")
+        return record
+
+    def get_points(self, receipt_id: str) -> int:
+        return self.get_record(receipt_id).points
+
+    def list_receipts(self, cursor, limit, retailer=None, purchased_from=None, purchased_to=None, include_points=False):
+        after = decode_cursor(cursor) if cursor else None
+        matches = []
+        for lock, stripe in zip(self.locks, self.stripes):
+            # copied under the lock: ingest may add or evict while we filter
+            with lock:
+                records = list(stripe.items())
+            matches.extend(
+                (record.purchaseDate, receipt_id, record) for receipt_id, record in records
+                if (retailer is None or record.retailer == retailer)
+                and (purchased_from is None or record.purchaseDate >= purchased_from)
+                and (purchased_to is None or record.purchaseDate <= purchased_to)
+                # (purchaseDate, ID) is sort_key, so this is the keyset cursor as the ORM store applies it
+                and (after is None or (record.purchaseDate, receipt_id) < after)
+            )
+        # the top of the merged stripes in KEYSET_ORDERING, plus one row to tell whether there's a next page
+        page = heapq.nlargest(limit + 1, matches, key=itemgetter(0, 1))
+        receipts = [
+            Receipt(hexadecimal_id=receipt_id, retailer=record.retailer, purchaseDate=record.purchaseDate,
+                    purchaseTime=record.purchaseTime, total_cents=record.total_cents, points=record.points)
+            for _, receipt_id, record in page[:limit]
+        ]
+        return receipts, encode_cursor(receipts[-1]) if len(page) > limit else None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_receipt_store() -> ReceiptStore:
+    # one instance per backend per process; the in-memory store *is* the data
+    path = settings.RECEIPTS_STORAGE_BACKEND
+    if path not in _stores:
+        with _stores_lock:
+            if path not in _stores:
+                _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+@receiver(setting_changed)
+def reset_receipt_stores(*, setting, **kwargs):
+    if setting.startswith("RECEIPTS_MEMORY_") or setting == "RECEIPTS_STORAGE_BACKEND":
+        _stores.clear()
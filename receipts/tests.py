@@ -1,34 +1,65 @@
 import datetime
+import io
 import json
-
-from django.test import TestCase
+import os
+import random
+import sqlite3
+import tempfile
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connections
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
-from .models import Receipt, Item
+from . import metrics, profiling, replicas, views
+from .models import WHITESPACE, Receipt, Item, ScoringJob, cents_to_dollars, dollars_to_cents
+from .admin import ReceiptAdmin
+from .loadtest import LatencyHistogram, Replay, read_trace, synthetic_trace
+from .middleware import AdmissionControlMiddleware
+from .pagination import KEYSET_ORDERING, after_cursor, encode_cursor
+from .profiling import PROFILE_ID_HEADER, ProfilingMiddleware
+from .query_budget import QueryBudgetTestMixin, QueryRecorder, fingerprint, get_query_budget
+from .replicas import copy_database, refresh_all, try_lock
+from .storage import ITEM_INSERT_BATCH_SIZE, InMemoryReceiptStore, get_receipt_store, reset_receipt_stores
+from .scoring import LEASE, claim_jobs, run_once
+from .routers import ReceiptShardRouter, db_for_receipt_id, replica_alias, shard_alias, shard_aliases, shard_for_receipt_id
 
 
 INVALID_RECEIPT_BAD_REQUEST_STR = "The receipt is invalid."
 ID_NOT_FOUND_STR = "No receipt found for that ID."
 
-def create_receipt_with_day_offset(days: int):
+# receipts can land on any shard when RECEIPTS_SHARD_COUNT > 1. Replicas are left out:
+# under tests they mirror their primary and reads are routed to the primary directly.
+SHARD_DATABASES = set(shard_aliases())
+
+def create_receipt_with_day_offset(days: int, hexadecimal_id: str = 'test-hex-id'):
     """
     Create a receipt with the given `question_text` and published the
     given number of `days` offset to now (negative for questions published
     in the past, positive for questions that have yet to be published).
+
+    The receipt is always created on 'default' (shard 0): without .using(),
+    Receipt.objects.create() has no instance for the router to shard by. Tests
+    that read it back through a view, which looks on the shard owning the ID,
+    pass an ID from shard_0_receipt_ids().
     """
     time = timezone.now() + datetime.timedelta(days=days)
     return Receipt.objects.create(
-        hexadecimal_id='test-hex-id',
+        hexadecimal_id=hexadecimal_id,
         retailer='test-retailer',
         purchaseDate=datetime.date(time.year, time.month, time.day),
         purchaseTime=datetime.time(time.hour, time.minute, 0),
-        total=3.14
+        total_cents=314
     )
 
 
-def create_item_with_price(receipt: Receipt, price: float):
-    return Item.objects.create(receipt=receipt, shortDescription='test-short-description', price=price)
+def create_item_with_price(receipt: Receipt, price: str):
+    return Item.objects.create(receipt=receipt, shortDescription='test-short-description', price_cents=dollars_to_cents(price))
 
 
 class ReceiptModelTests(TestCase):
@@ -52,15 +83,10 @@ class ItemModelTests(TestCase):
     def test_floating_point_precision_for_more_than_2_decimal_places_item(self):
         '''
         Test creating Receipts with Items that have a price with > 2 decimal points.
-        It seems like Django's DecimalField "decimal_places" doesn't self-enforce
-        when directly created with the raw Model class constructor,
-        and the raw float value is stored in the table regardless of how many decimal places it has.
+        Money is stored as integer cents, so fractions of a cent are rounded
+        (half to even) when the price is converted, and never reach the database.
 
-        Let's make an assumption to permit this for now, because there isn't much information
-        about what the value gained from writing a lot of logic to validate decimal places is,
-        such as what the concrete needs of our application are.
-
-        However, if necessary, modify this unit test to reflect any logic needed to validate
+        If necessary, modify this unit test to reflect any logic needed to validate
         decimal places, e.g. if we want to send a 400 bad request if the input has > 2 decimal places.
         '''
 
@@ -74,17 +100,36 @@ class ItemModelTests(TestCase):
 
         receipt = create_receipt_with_day_offset(0)
 
-        item = create_item_with_price(receipt, 1.255)
-        self.assertEqual(item.price, 1.255)
+        item = create_item_with_price(receipt, "1.255")
+        self.assertEqual(item.price_cents, 126)
+
+        item = create_item_with_price(receipt, "1.403")
+        self.assertEqual(item.price_cents, 140)
+
+        item = create_item_with_price(receipt, "-99.999")
+        self.assertEqual(item.price_cents, -10000)
 
-        item = create_item_with_price(receipt, 1.403)
-        self.assertEqual(item.price, 1.403)
 
-        item = create_item_with_price(receipt, -99.999)
-        self.assertEqual(item.price, -99.999)
+    def test_cents_format_as_dollar_amounts(self):
+        for cents, dollars in ((3535, "35.35"), (5, "0.05"), (-5, "-0.05"), (-10000, "-100.00"), (0, "0.00")):
+            self.assertEqual(cents_to_dollars(cents), dollars)
+            self.assertEqual(dollars_to_cents(dollars), cents)
+
+
+    def test_amounts_that_are_not_finite_or_too_large_are_rejected(self):
+        '''
+        "1e999997" would be a million-digit number of cents; it must be rejected
+        without computing it.
+        '''
+        for amount in ("1e999997", "NaN", "sNaN", "Infinity", "-Infinity", "10000000000000000.00"):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                dollars_to_cents(amount)
+        self.assertEqual(dollars_to_cents("9999999999999999.99"), 999999999999999999)
 
 
 class ReceiptViewTests(TestCase):
+    databases = SHARD_DATABASES
+
     def test_sending_completely_valid_json_to_receipt_process_view(self):
         '''
         Test that sending a completely valid json is fine and returns 200
@@ -141,11 +186,11 @@ class ReceiptViewTests(TestCase):
 
         the_json = json.loads(response.content.decode("utf-8"))
         hex_id = the_json['id']
-        receipt = Receipt.objects.get(hexadecimal_id=hex_id)
+        receipt = Receipt.objects.using(db_for_receipt_id(hex_id)).get(hexadecimal_id=hex_id)
 
-        self.assertEqual(str(receipt.total), "2.66")
+        self.assertEqual(receipt.total_cents, 266)
         for item in receipt.item_set.all():
-            self.assertTrue(str(item.price) in {"1.26", "1.40", "2.00", "-100.00"})
+            self.assertTrue(item.price_cents in {126, 140, 200, -10000})
 
 
     def test_sending_receipts_with_negative_price_items_to_receipt_process_view_is_fine(self):
@@ -258,6 +303,24 @@ class ReceiptViewTests(TestCase):
         self.assertContains(response, INVALID_RECEIPT_BAD_REQUEST_STR, status_code=400)
     
 
+    def test_sending_receipts_with_non_finite_or_huge_amounts_throws_error(self):
+        '''
+        Totals and prices must be finite and fit in a 64-bit number of cents. Crafted
+        amounts like "1e999997" are rejected right away, not after minutes of arithmetic.
+        '''
+        url = reverse("receipts:get_id_for_receipt")
+        for amount in ("1e999997", "NaN", "Infinity"):
+            for field in ("total", "price"):
+                receipt = json.loads(receipt_json_with_items(1))
+                if field == "total":
+                    receipt["total"] = amount
+                else:
+                    receipt["items"][0]["price"] = amount
+                with self.subTest(amount=amount, field=field):
+                    response = self.client.post(url, {'receipt_json_str': json.dumps(receipt)})
+                    self.assertContains(response, INVALID_RECEIPT_BAD_REQUEST_STR, status_code=400)
+    
+
     def test_sending_json_with_extra_kvps_to_receipt_process_view_is_fine(self):
         '''
         Test that sending json with extra key/value pairs is ok and returns 200.
@@ -540,4 +603,987 @@ class ReceiptViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertNotContains(response, ID_NOT_FOUND_STR, status_code=200)
         the_json = json.loads(response.content.decode("utf-8"))
-        self.assertEqual(the_json['points'], 109)
\ No newline at end of file
+        self.assertEqual(the_json['points'], 109)
+
+
+class ShardRouterTests(TestCase):
+    def test_receipt_ids_map_to_a_stable_shard_in_range(self):
+        '''
+        Test that a receipt ID always lands on the same shard, that the shard only depends
+        on the ID prefix, and that IDs spread over every shard.
+        '''
+        ids = [f"{n:08x}-3b6-8b4c-830d-77c75e9644e6" for n in range(200)]
+        shards = [shard_for_receipt_id(receipt_id, 4) for receipt_id in ids]
+
+        self.assertEqual(shards, [shard_for_receipt_id(receipt_id, 4) for receipt_id in ids])
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+        self.assertEqual(shard_for_receipt_id("c288fc46-aaa", 4), shard_for_receipt_id("c288fc46-bbb", 4))
+
+
+    @override_settings(RECEIPTS_SHARD_COUNT=4)
+    def test_router_only_migrates_receipts_app_onto_extra_shards(self):
+        router = ReceiptShardRouter()
+        self.assertEqual(shard_aliases(), ["default", "shard_1", "shard_2", "shard_3"])
+        self.assertTrue(router.allow_migrate("shard_2", "receipts"))
+        self.assertFalse(router.allow_migrate("shard_2", "auth"))
+        self.assertIsNone(router.allow_migrate("default", "auth"))
+
+
+    @override_settings(RECEIPTS_SHARD_COUNT=4)
+    def test_router_sends_new_receipts_and_items_to_the_owning_shard(self):
+        router = ReceiptShardRouter()
+        receipt = Receipt(hexadecimal_id="c288fc46-3b6-8b4c-830d-77c75e9644e6")
+        item = Item(receipt=receipt)
+        self.assertEqual(router.db_for_write(Receipt, instance=receipt), db_for_receipt_id(receipt.pk))
+        self.assertEqual(router.db_for_write(Item, instance=item), db_for_receipt_id(receipt.pk))
+
+
+class ReshardTests(TransactionTestCase):
+    # reshard_receipts commits on every shard, so a TestCase transaction can't hold it
+    databases = SHARD_DATABASES
+
+    def setUp(self):
+        # the in-memory test databases share one cache, where a shard written from one
+        # thread while another reads it fails with "table is locked" instead of waiting
+        # as the database files do, so the shards are resharded one after the other
+        patcher = mock.patch(
+            "receipts.management.commands.reshard_receipts.fan_out",
+            lambda func: [func(alias) for alias in shard_aliases()],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextmanager
+    def sqlite_database(self, alias: str):
+        '''
+        A database file with the receipts tables, configured as `alias` until the block
+        ends, and its path.
+        '''
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(type(self), "databases", self.databases | {alias}):
+            path = os.path.join(directory, f"{alias}.sqlite3")
+            connections.settings[alias] = {**connections.settings["default"], "NAME": path}
+            try:
+                with connections[alias].schema_editor() as editor:
+                    for model in (Receipt, Item, ScoringJob):
+                        editor.create_model(model)
+                yield path
+            finally:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+
+
+    def create_receipts(self, db: str, receipt_ids: list[str]):
+        for receipt_id in receipt_ids:
+            receipt = Receipt.objects.using(db).create(
+                hexadecimal_id=receipt_id, retailer="Target", purchaseDate=datetime.date(2022, 1, 1),
+                purchaseTime=datetime.time(13, 1), total_cents=100,
+            )
+            Item.objects.using(db).bulk_create(Item(receipt=receipt, shortDescription=f"Item {i}", price_cents=100) for i in range(2))
+            ScoringJob.objects.using(db).create(receipt=receipt)
+
+
+    def assertOnOwningShard(self, receipt_ids: list[str]):
+        for receipt_id in receipt_ids:
+            owner = db_for_receipt_id(receipt_id)
+            for alias in shard_aliases():
+                with self.subTest(receipt_id=receipt_id, alias=alias):
+                    self.assertEqual(Receipt.objects.using(alias).filter(pk=receipt_id).exists(), alias == owner)
+                    self.assertEqual(Item.objects.using(alias).filter(receipt_id=receipt_id).count(), 2 if alias == owner else 0)
+                    self.assertEqual(ScoringJob.objects.using(alias).filter(pk=receipt_id).exists(), alias == owner)
+
+
+    def test_reshard_moves_misplaced_receipts_with_their_items_and_jobs(self):
+        '''
+        Everything starts on shard 0, as if the shard count had just been raised;
+        every receipt ends up on the shard that owns it, and a second run moves nothing.
+        '''
+        with ExitStack() as stack:
+            if len(shard_aliases()) == 1:
+                # a single-shard run has nowhere to move receipts to, so add a second shard
+                stack.enter_context(self.sqlite_database(shard_alias(1)))
+                stack.enter_context(override_settings(RECEIPTS_SHARD_COUNT=2))
+
+            receipt_ids = [f"{n:08x}-0000-0000-0000-000000000000" for n in range(12)]
+            self.create_receipts("default", receipt_ids)
+
+            output = io.StringIO()
+            call_command("reshard_receipts", stdout=output)
+            moved = sum(db_for_receipt_id(receipt_id) != "default" for receipt_id in receipt_ids)
+            self.assertGreater(moved, 0)
+            self.assertIn(f"default: moved {moved} receipt(s)", output.getvalue())
+            self.assertOnOwningShard(receipt_ids)
+
+            output = io.StringIO()
+            call_command("reshard_receipts", stdout=output)
+            self.assertNotRegex(output.getvalue(), r"moved [1-9]")
+
+
+    def test_draining_a_removed_shard_moves_all_of_its_receipts_out(self):
+        receipt_ids = [f"{n:08x}-0000-0000-0000-000000000000" for n in range(6)]
+        # a shard that is no longer configured, still holding receipts, under the alias
+        # reshard_receipts gives the first file it drains
+        with self.sqlite_database("reshard_drain_0") as path:
+            self.create_receipts("reshard_drain_0", receipt_ids)
+            connections["reshard_drain_0"].close()
+
+            output = io.StringIO()
+            call_command("reshard_receipts", drain=[path], stdout=output)
+
+            self.assertIn(f"reshard_drain_0: moved {len(receipt_ids)} receipt(s)", output.getvalue())
+            drained = sqlite3.connect(path)
+            self.assertEqual(drained.execute("SELECT COUNT(*) FROM receipts_receipt").fetchone(), (0,))
+            self.assertEqual(drained.execute("SELECT COUNT(*) FROM receipts_item").fetchone(), (0,))
+            drained.close()
+        self.assertOnOwningShard(receipt_ids)
+
+
+class ReadReplicaTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def test_copy_database_takes_a_snapshot_of_the_primary(self):
+        '''
+        Test that a replica refreshed with the backup API sees rows written to the primary
+        up to the refresh, and nothing written after it.
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = os.path.join(directory, "primary.sqlite3")
+            replica_path = os.path.join(directory, "replica.sqlite3")
+            primary = sqlite3.connect(primary_path)
+            primary.execute("CREATE TABLE t (x INTEGER)")
+            primary.execute("INSERT INTO t VALUES (1)")
+            primary.commit()
+
+            copy_database(primary_path, replica_path)
+            primary.execute("INSERT INTO t VALUES (2)")
+            primary.commit()
+            primary.close()
+
+            replica = sqlite3.connect(replica_path)
+            self.assertEqual(replica.execute("SELECT x FROM t").fetchall(), [(1,)])
+            replica.close()
+
+
+    @override_settings(RECEIPTS_READ_REPLICA=True)
+    @mock.patch("receipts.replicas.ensure_refresher_started")
+    @mock.patch("receipts.routers.replica_is_primary", return_value=False)
+    def test_points_api_falls_back_to_the_primary_for_receipts_newer_than_the_replica(self, replica_is_primary, ensure_refresher_started):
+        '''
+        Test that points reads go to the replica when it's enabled, and that a receipt
+        missing from the replica snapshot is still found on the primary.
+        '''
+        receipt = create_receipt_with_day_offset(0, hexadecimal_id=shard_0_receipt_ids(1)[0])
+        primary = db_for_receipt_id(receipt.hexadecimal_id)
+        self.assertEqual(db_for_receipt_id(receipt.hexadecimal_id, for_read=True), replica_alias(primary))
+        ensure_refresher_started.assert_called()
+
+        url = reverse("receipts:points", args=(receipt.hexadecimal_id,))
+        with mock.patch("receipts.storage.Receipt.objects.using") as using:
+            # an empty replica snapshot
+            using.side_effect = lambda db: Receipt.objects.none() if db == replica_alias(primary) else Receipt.objects.db_manager(db).all()
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([call.args[0] for call in using.call_args_list], [replica_alias(primary), primary])
+
+
+    def test_only_one_open_lock_file_holds_the_refresh_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "replica.sqlite3.refresh-lock")
+            held = try_lock(path)
+            self.assertIsNotNone(held)
+            # flock locks belong to the open file, so this is what another process sees
+            self.assertIsNone(try_lock(path))
+            os.close(held)
+            taken_over = try_lock(path)
+            self.assertIsNotNone(taken_over)
+            os.close(taken_over)
+
+
+    @mock.patch("receipts.replicas.refresh_replica")
+    @mock.patch("receipts.replicas.replica_is_primary", return_value=False)
+    @mock.patch("receipts.replicas.shard_aliases", return_value=["default"])
+    def test_only_the_refresh_lock_holder_refreshes_a_replica(self, shard_aliases, replica_is_primary, refresh_replica):
+        '''
+        Of all the serving processes, only the one holding a replica's refresh lock keeps
+        copying it. The others only take a first snapshot when there's none at all.
+        '''
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch("receipts.replicas.replica_path", return_value=os.path.join(directory, "replica.sqlite3")):
+            other_process = try_lock(os.path.join(directory, "replica.sqlite3.refresh-lock"))
+            refresh_all()
+            refresh_replica.assert_not_called()
+            refresh_all(initial=True)
+            refresh_replica.assert_called_once_with("default")
+
+            refresh_replica.reset_mock()
+            os.close(other_process)
+            try:
+                refresh_all()
+                refresh_replica.assert_called_once_with("default")
+            finally:
+                os.close(replicas._refresh_locks.pop("default"))
+
+
+    def test_metrics_endpoint_returns_counters_and_gauges_to_staff_only(self):
+        url = reverse("receipts:metrics")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response["Location"])
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        the_json = json.loads(response.content.decode("utf-8"))
+        self.assertIn("counters", the_json)
+        self.assertIn("gauges", the_json)
+
+
+class PointsCachingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def test_points_response_has_strong_etag_and_short_lived_cache_control(self):
+        receipt = create_receipt_with_day_offset(0, hexadecimal_id=shard_0_receipt_ids(1)[0])
+        url = reverse("receipts:points", args=(receipt.hexadecimal_id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertNotIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+
+    def test_points_api_with_matching_if_none_match_returns_304_without_scoring(self):
+        '''
+        Test that repeating a points request with the ETag from the first response
+        gets an empty 304 from a single query for the stored score, without loading items or rescoring.
+        '''
+        receipt = create_receipt_with_day_offset(0, hexadecimal_id=shard_0_receipt_ids(1)[0])
+        create_item_with_price(receipt, "1.25")
+        receipt.points = receipt.get_points()
+        receipt.save()
+        url = reverse("receipts:points", args=(receipt.hexadecimal_id,))
+        etag = self.client.get(url)["ETag"]
+
+        with mock.patch.object(Receipt, "get_points") as get_points, self.assertNumQueries(1):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        get_points.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(url, headers={"If-None-Match": f"W/{etag}"})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, headers={"If-None-Match": '"some-other-etag"'})
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_points_api_with_if_none_match_on_id_that_does_not_exist_returns_404(self):
+        url = reverse("receipts:points", args=("id-that-does-not-exist",))
+        response = self.client.get(url, headers={"If-None-Match": "*"})
+        self.assertContains(response, ID_NOT_FOUND_STR, status_code=404)
+
+
+class AdmissionControlTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @override_settings(RECEIPTS_MAX_INFLIGHT_INGESTS=0, RECEIPTS_RETRY_AFTER_SECONDS=7)
+    def test_ingest_over_budget_is_shed_with_retry_after_while_points_are_still_served(self):
+        shed_before = metrics.snapshot()["counters"].get("admission_shed.ingest", 0)
+
+        url = reverse("receipts:get_id_for_receipt")
+        response = self.client.post(url, {"receipt_json_str": "{}"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(metrics.snapshot()["counters"]["admission_shed.ingest"], shed_before + 1)
+
+        receipt = create_receipt_with_day_offset(0, hexadecimal_id=shard_0_receipt_ids(1)[0])
+        response = self.client.get(reverse("receipts:points", args=(receipt.hexadecimal_id,)))
+        self.assertEqual(response.status_code, 200)
+
+
+    @override_settings(RECEIPTS_MAX_INFLIGHT_READS=2, RECEIPTS_MAX_INGEST_QUEUE_SECONDS=0)
+    def test_ingests_are_shed_first_while_reads_saturate_their_budget(self):
+        '''
+        Test that while points reads fill their budget, further reads and any ingest are
+        shed, and that releasing a read admits reads again.
+        '''
+        middleware = AdmissionControlMiddleware(lambda request: None)
+        self.assertTrue(middleware.admit_read())
+        self.assertTrue(middleware.admit_read())
+        self.assertFalse(middleware.admit_read())
+        self.assertFalse(middleware.admit_ingest())
+
+        middleware.release("read")
+        self.assertTrue(middleware.admit_ingest())
+        self.assertEqual(middleware.inflight, {"ingest": 1, "read": 1})
+
+
+SCORING_TEST_RECEIPT_JSON = '''
+{
+    "retailer": "M&M Corner Market",
+    "purchaseDate": "2022-03-20",
+    "purchaseTime": "14:33",
+    "items": [
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"},
+        {"shortDescription": "Gatorade", "price": "2.25"}
+    ],
+    "total": "9.00"
+}
+'''
+
+
+class BackgroundScoringTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def test_inline_scoring_stores_points_at_ingest(self):
+        hex_id = post_receipt(self, SCORING_TEST_RECEIPT_JSON).json()["id"]
+        receipt = Receipt.objects.using(db_for_receipt_id(hex_id)).get(pk=hex_id)
+        self.assertEqual(receipt.points, 109)
+        self.assertFalse(ScoringJob.objects.using(db_for_receipt_id(hex_id)).exists())
+
+
+    @override_settings(RECEIPTS_SCORING="background", RECEIPTS_PENDING_POINTS_RESPONSE="accepted")
+    def test_background_scoring_queues_a_job_that_a_worker_scores(self):
+        '''
+        Test that with background scoring, ingest only queues a job, points answers 202
+        until a worker has run, and the stored score is served afterwards.
+        '''
+        hex_id = post_receipt(self, SCORING_TEST_RECEIPT_JSON).json()["id"]
+        db = db_for_receipt_id(hex_id)
+        self.assertIsNone(Receipt.objects.using(db).get(pk=hex_id).points)
+        self.assertTrue(ScoringJob.objects.using(db).filter(pk=hex_id).exists())
+
+        url = reverse("receipts:points", args=(hex_id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("ETag", response)
+
+        self.assertEqual(run_once(), 1)
+        self.assertEqual(Receipt.objects.using(db).get(pk=hex_id).points, 109)
+        self.assertFalse(ScoringJob.objects.using(db).filter(pk=hex_id).exists())
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["points"], 109)
+
+
+    @override_settings(RECEIPTS_SCORING="background", RECEIPTS_PENDING_POINTS_RESPONSE="inline")
+    def test_points_api_scores_a_queued_receipt_inline_when_configured(self):
+        hex_id = post_receipt(self, SCORING_TEST_RECEIPT_JSON).json()["id"]
+        response = self.client.get(reverse("receipts:points", args=(hex_id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["points"], 109)
+
+
+    @override_settings(RECEIPTS_SCORING="background")
+    def test_claimed_jobs_are_only_taken_over_after_the_lease_expires(self):
+        hex_id = post_receipt(self, SCORING_TEST_RECEIPT_JSON).json()["id"]
+        db = db_for_receipt_id(hex_id)
+        self.assertEqual(claim_jobs(db, 10), [hex_id])
+        self.assertEqual(claim_jobs(db, 10), [])
+
+        ScoringJob.objects.using(db).filter(pk=hex_id).update(claimed_at=timezone.now() - LEASE - datetime.timedelta(seconds=1))
+        self.assertEqual(claim_jobs(db, 10), [hex_id])
+        self.assertEqual(ScoringJob.objects.using(db).get(pk=hex_id).attempts, 2)
+
+
+    @override_settings(RECEIPTS_SCORING="background")
+    def test_idle_polls_only_read(self):
+        '''
+        A poll with nothing to claim must not write (or open a transaction, which
+        takes SQLite's write lock), or idle workers would contend with ingest.
+        '''
+        with QueryRecorder().recording() as recorder:
+            self.assertEqual(run_once(), 0)
+        self.assertTrue(recorder.queries)
+        self.assertTrue(all(sql.startswith("SELECT") for sql in recorder.queries), recorder.queries)
+
+
+    @override_settings(RECEIPTS_SCORING="background")
+    def test_a_batch_is_claimed_oldest_first_in_a_single_update(self):
+        hex_ids = [post_receipt(self, SCORING_TEST_RECEIPT_JSON).json()["id"] for _ in range(5)]
+        db = db_for_receipt_id(hex_ids[0])
+        # oldest first, whichever order the IDs sort in
+        for age, hex_id in enumerate(reversed(hex_ids)):
+            ScoringJob.objects.using(db_for_receipt_id(hex_id)).filter(pk=hex_id).update(created_at=timezone.now() - datetime.timedelta(minutes=age))
+        on_db = [hex_id for hex_id in hex_ids if db_for_receipt_id(hex_id) == db]
+
+        with QueryRecorder().recording() as recorder:
+            claimed = claim_jobs(db, 3)
+        self.assertEqual(claimed, on_db[:3])
+        self.assertEqual(len([sql for sql in recorder.queries if sql.startswith("UPDATE")]), 1)
+        self.assertEqual(claim_jobs(db, 10), on_db[3:])
+
+
+def receipt_json_with_items(item_count: int, retailer: str = "Target", purchase_date: str = "2022-01-01") -> str:
+    return json.dumps({
+        "retailer": retailer,
+        "purchaseDate": purchase_date,
+        "purchaseTime": "13:01",
+        "items": [{"shortDescription": f"Item {i}", "price": "1.00"} for i in range(item_count)],
+        "total": f"{item_count}.00",
+    })
+
+
+def post_receipt(test: TestCase, receipt_json: str, **headers):
+    '''
+    Post `receipt_json` to the process endpoint with the test's client, check that it
+    was accepted, and return the response.
+    '''
+    response = test.client.post(reverse("receipts:get_id_for_receipt"), {"receipt_json_str": receipt_json}, headers=headers)
+    test.assertEqual(response.status_code, 200)
+    return response
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    databases = SHARD_DATABASES
+
+    def test_processing_a_receipt_stays_within_budget_however_many_items_it_has(self):
+        # items are inserted ITEM_INSERT_BATCH_SIZE at a time; the budget allows one query per extra batch
+        for scoring in ("inline", "background"):
+            for item_count in (0, 1, 50, ITEM_INSERT_BATCH_SIZE, ITEM_INSERT_BATCH_SIZE + 1, 1000):
+                with self.subTest(scoring=scoring, item_count=item_count), override_settings(RECEIPTS_SCORING=scoring):
+                    with self.assertWithinQueryBudget("receipts:get_id_for_receipt", batched_rows=item_count):
+                        hex_id = post_receipt(self, receipt_json_with_items(item_count)).json()["id"]
+                    self.assertEqual(Item.objects.using(db_for_receipt_id(hex_id)).filter(receipt_id=hex_id).count(), item_count)
+
+
+    def test_points_stay_within_budget_for_scored_and_unscored_receipts(self):
+        for scoring, pending_response in (("inline", "inline"), ("background", "inline"), ("background", "accepted")):
+            with self.subTest(scoring=scoring, pending_response=pending_response), \
+                    override_settings(RECEIPTS_SCORING=scoring, RECEIPTS_PENDING_POINTS_RESPONSE=pending_response):
+                hex_id = post_receipt(self, receipt_json_with_items(50)).json()["id"]
+                with self.assertWithinQueryBudget("receipts:points", hex_id):
+                    response = self.client.get(reverse("receipts:points", args=(hex_id,)))
+                self.assertIn(response.status_code, (200, 202))
+
+
+    def test_batch_allowance_only_grows_with_the_number_of_item_batches(self):
+        view = views.get_id_for_receipt
+        self.assertEqual(get_query_budget(view), 6)
+        self.assertEqual(get_query_budget(view, ITEM_INSERT_BATCH_SIZE), 6)
+        self.assertEqual(get_query_budget(view, ITEM_INSERT_BATCH_SIZE + 1), 7)
+        self.assertEqual(get_query_budget(view, 1000), 9)
+
+
+    @override_settings(RECEIPTS_QUERY_BUDGET_WARNINGS=True)
+    def test_middleware_does_not_warn_about_large_receipts_within_their_batch_allowance(self):
+        with self.assertNoLogs("receipts.query_budget", level="WARNING"):
+            post_receipt(self, receipt_json_with_items(1000))
+
+
+    def test_fingerprints_collapse_literals_and_placeholder_lists(self):
+        self.assertEqual(
+            fingerprint("INSERT INTO item VALUES (%s, %s), (%s, %s), (%s, %s)"),
+            fingerprint("INSERT INTO item VALUES (%s, %s)"),
+        )
+        self.assertEqual(fingerprint("SELECT 1 FROM receipt WHERE id = 'abc' LIMIT 21"), "SELECT ? FROM receipt WHERE id = ? LIMIT ?")
+
+
+    @override_settings(RECEIPTS_QUERY_BUDGET_WARNINGS=True)
+    @mock.patch.object(views.points, "query_budget", 0)
+    def test_middleware_warns_about_requests_over_budget(self):
+        hex_id = post_receipt(self, receipt_json_with_items(1)).json()["id"]
+        before = metrics.snapshot()["counters"].get("query_budget_exceeded.receipts:points", 0)
+        with self.assertLogs("receipts.query_budget", level="WARNING") as logs:
+            response = self.client.get(reverse("receipts:points", args=(hex_id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("over the receipts:points budget of 0", logs.output[0])
+        self.assertEqual(metrics.snapshot()["counters"]["query_budget_exceeded.receipts:points"], before + 1)
+
+
+class ReceiptListingTests(QueryBudgetTestMixin, TestCase):
+    databases = SHARD_DATABASES
+
+    def list_all(self, **params) -> list[dict]:
+        listed = []
+        while True:
+            response = self.client.get(reverse("receipts:list_receipts"), params)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.content.decode("utf-8"))
+            self.assertLessEqual(len(page["receipts"]), params.get("limit", 25))
+            listed += page["receipts"]
+            if page["next"] is None:
+                return listed
+            params["cursor"] = page["next"]
+
+
+    def test_listing_pages_through_every_receipt_newest_first(self):
+        purchase_dates = {}
+        for day in (3, 1, 2, 2, 5, 4, 4):
+            purchase_date = f"2022-01-{day:02}"
+            purchase_dates[post_receipt(self, receipt_json_with_items(3, "Target", purchase_date)).json()["id"]] = purchase_date
+        expected = sorted(purchase_dates, key=lambda hex_id: (purchase_dates[hex_id], hex_id), reverse=True)
+
+        listed = self.list_all(limit=2)
+        self.assertEqual([receipt["id"] for receipt in listed], expected)
+        self.assertEqual(listed[0]["purchaseDate"], "2022-01-05")
+        self.assertNotIn("points", listed[0])
+
+
+    def test_listing_filters_on_retailer_and_purchase_date_range(self):
+        receipts = [
+            post_receipt(self, receipt_json_with_items(3, retailer, purchase_date)).json()["id"]
+            for retailer, purchase_date in (("Target", "2022-01-01"), ("Target", "2022-02-01"), ("Target", "2022-03-01"), ("Walgreens", "2022-02-01"))
+        ]
+
+        listed = self.list_all(limit=1, retailer="Target", purchaseDateFrom="2022-01-15", purchaseDateTo="2022-03-01")
+        self.assertEqual([(receipt["retailer"], receipt["purchaseDate"]) for receipt in listed], [("Target", "2022-03-01"), ("Target", "2022-02-01")])
+        self.assertTrue({receipt["id"] for receipt in listed} <= set(receipts))
+
+
+    @override_settings(RECEIPTS_SCORING="background")
+    def test_listing_includes_points_of_unscored_receipts_within_budget(self):
+        receipts = [post_receipt(self, receipt_json_with_items(3, "Target", f"2022-01-{day:02}")).json()["id"] for day in range(1, 7)]
+        # score some of them, and leave the rest queued
+        run_once(batch_size=1)
+        expected = {hex_id: Receipt.objects.using(db_for_receipt_id(hex_id)).get(pk=hex_id).get_points() for hex_id in receipts}
+
+        listed = {}
+        cursor = ""
+        for _ in range(2):
+            with self.assertWithinQueryBudget("receipts:list_receipts"):
+                response = self.client.get(reverse("receipts:list_receipts"), {"limit": 3, "include": "points", "cursor": cursor})
+            page = json.loads(response.content.decode("utf-8"))
+            listed.update((receipt["id"], receipt["points"]) for receipt in page["receipts"])
+            cursor = page["next"]
+        self.assertEqual(listed, expected)
+
+
+    def test_listing_rejects_invalid_parameters(self):
+        url = reverse("receipts:list_receipts")
+        for params in ({"cursor": "not-a-cursor"}, {"limit": 0}, {"limit": "many"}, {"purchaseDateFrom": "01/02/2022"}):
+            with self.subTest(params=params):
+                self.assertContains(self.client.get(url, params), "Invalid listing parameters.", status_code=400)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def test_pages_after_a_cursor_seek_the_index_instead_of_scanning_it(self):
+        '''
+        A page deep into the receipts must cost the same as the first: the index is
+        searched from the cursor on, not scanned through every row before it.
+        '''
+        cursor = encode_cursor(Receipt(purchaseDate=datetime.date(2022, 1, 1), hexadecimal_id="8" * 8))
+        for index, queryset in (("receipt_date_idx", Receipt.objects.all()), ("receipt_retailer_date_idx", Receipt.objects.filter(retailer="Target"))):
+            with self.subTest(index=index):
+                plan = queryset.filter(after_cursor(cursor)).order_by(*KEYSET_ORDERING)[:26].explain()
+                self.assertIn(f"SEARCH receipts_receipt USING INDEX {index}", plan)
+                self.assertNotIn("SCAN", plan)
+
+
+def shard_0_receipt_ids(count: int) -> list[str]:
+    # the admin lists shard 0 unless another shard is picked
+    candidates = (f"{n:08x}-0000-0000-0000-000000000000" for n in range(10_000))
+    return [receipt_id for receipt_id in candidates if shard_for_receipt_id(receipt_id) == 0][:count]
+
+
+class ReceiptAdminTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+
+    def create_receipts(self, retailers_and_dates) -> list[Receipt]:
+        ids = shard_0_receipt_ids(len(retailers_and_dates))
+        return [
+            Receipt.objects.create(hexadecimal_id=receipt_id, retailer=retailer, purchaseDate=purchase_date,
+                                   purchaseTime=datetime.time(13, 1), total_cents=100, points=1)
+            for receipt_id, (retailer, purchase_date) in zip(ids, retailers_and_dates)
+        ]
+
+
+    @mock.patch.object(ReceiptAdmin, "list_per_page", 2)
+    def test_changelist_pages_through_every_receipt_with_a_keyset_cursor(self):
+        receipts = self.create_receipts([("Target", datetime.date(2022, 1, day)) for day in (3, 1, 2, 2, 5)])
+        expected = [r.pk for r in sorted(receipts, key=lambda r: (r.purchaseDate, r.pk), reverse=True)]
+
+        seen = []
+        url = reverse("admin:receipts_receipt_changelist")
+        next_page = ""
+        while next_page is not None:
+            response = self.client.get(url + next_page)
+            self.assertEqual(response.status_code, 200)
+            seen += [receipt.pk for receipt in response.context["cl"].result_list]
+            next_page = response.context["cl"].next_page_url
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(url, {"after": "not-a-cursor"})
+        self.assertRedirects(response, url + "?e=1", fetch_redirect_response=False)
+
+
+    def test_changelist_pages_after_a_cursor_seek_the_date_index(self):
+        '''
+        A deep changelist page must cost the same as the first: its rows are found by
+        searching the date index from the cursor on, not by scanning every row before it.
+        '''
+        receipts = self.create_receipts([("Target", datetime.date(2022, 1, day)) for day in (1, 2, 3)])
+        executed = []
+
+        def record(execute, sql, params, many, context):
+            executed.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connections["default"].execute_wrapper(record):
+            response = self.client.get(reverse("admin:receipts_receipt_changelist"), {"after": encode_cursor(receipts[2])})
+        self.assertEqual([r.pk for r in response.context["cl"].result_list], [receipts[1].pk, receipts[0].pk])
+
+        # explained with its parameters still bound, as it runs: SQLite plans literals differently
+        (sql, params), = [(sql, params) for sql, params in executed if sql.startswith('SELECT "receipts_receipt"."hexadecimal_id"') and "ORDER BY" in sql]
+        with connections["default"].cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertEqual(plan, ["SEARCH receipts_receipt USING INDEX receipt_date_idx (purchaseDate<?)"])
+
+
+    def test_changelist_search_matches_receipt_id_or_retailer_prefix(self):
+        receipts = self.create_receipts([("Target", datetime.date(2022, 1, 1)), ("Tarjay", datetime.date(2022, 1, 2)), ("Walgreens", datetime.date(2022, 1, 3))])
+        url = reverse("admin:receipts_receipt_changelist")
+
+        response = self.client.get(url, {"q": "Tar"})
+        self.assertEqual([r.retailer for r in response.context["cl"].result_list], ["Tarjay", "Target"])
+        response = self.client.get(url, {"q": receipts[2].pk})
+        self.assertEqual([r.retailer for r in response.context["cl"].result_list], ["Walgreens"])
+
+        # an unfiltered list is sized without counting its rows
+        response = self.client.get(url)
+        self.assertTrue(response.context["cl"].result_count_is_estimate)
+        self.assertGreaterEqual(response.context["cl"].result_count, 3)
+
+
+    def test_change_view_shows_items_inline_in_a_constant_number_of_queries(self):
+        query_counts = []
+        for receipt, item_count in zip(self.create_receipts([("Target", datetime.date(2022, 1, 1))] * 2), (1, 30)):
+            Item.objects.bulk_create([Item(receipt=receipt, shortDescription=f"Item {i}", price_cents=100) for i in range(item_count)])
+            url = reverse("admin:receipts_receipt_change", args=(receipt.pk,))
+            # warm up the content type cache
+            self.client.get(url)
+            recorder = QueryRecorder()
+            with recorder.recording():
+                response = self.client.get(url)
+            self.assertContains(response, f"Item {item_count - 1}")
+            query_counts.append(len(recorder.queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+    def test_saving_a_receipt_stores_a_fresh_score(self):
+        receipt, = self.create_receipts([("Target", datetime.date(2022, 1, 1))])
+        response = self.client.post(reverse("admin:receipts_receipt_change", args=(receipt.pk,)), {
+            "hexadecimal_id": receipt.pk, "retailer": "Target", "purchaseDate": "2022-01-01", "purchaseTime": "13:01:00", "total_cents": "100",
+            "item_set-TOTAL_FORMS": "0", "item_set-INITIAL_FORMS": "0",
+        })
+        self.assertEqual(response.status_code, 302)
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.points, receipt.get_points())
+        self.assertNotEqual(receipt.points, 1)
+
+
+    def test_editing_a_receipt_invalidates_cached_points(self):
+        '''
+        After an admin edit changes a receipt's points, the ETag clients cached
+        before no longer matches, so they get the new points rather than a 304.
+        '''
+        receipt, = self.create_receipts([("Target", datetime.date(2022, 1, 1))])
+        url = reverse("receipts:points", args=(receipt.pk,))
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        self.client.post(reverse("admin:receipts_receipt_change", args=(receipt.pk,)), {
+            "hexadecimal_id": receipt.pk, "retailer": "Walgreens", "purchaseDate": "2022-01-01", "purchaseTime": "13:01:00", "total_cents": "100",
+            "item_set-TOTAL_FORMS": "0", "item_set-INITIAL_FORMS": "0",
+        })
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        receipt.refresh_from_db()
+        self.assertEqual(response.json()["points"], receipt.points)
+
+
+class SQLPointsTests(TestCase):
+    databases = SHARD_DATABASES
+
+    # retailer and description characters, including ones where Python and SQL
+    # string functions tend to disagree: non-ASCII letters and digits, and whitespace
+    # other than spaces
+    CHARACTERS = "aZ09 -&'.éßЖ中٣²" + WHITESPACE[:8] + "\xa0\u3000"
+
+    def random_receipt(self, rng: random.Random, number: int) -> Receipt:
+        receipt_id = f"sql-points-{number}"
+        receipt = Receipt.objects.using(db_for_receipt_id(receipt_id)).create(
+            hexadecimal_id=receipt_id,
+            retailer="".join(rng.choices(self.CHARACTERS, k=rng.randint(0, 12))),
+            purchaseDate=datetime.date(2022, 1, 1) + datetime.timedelta(days=rng.randint(0, 365)),
+            # often right on, or either side of, the 2pm and 4pm boundaries
+            purchaseTime=rng.choice([datetime.time(rng.randint(0, 23), rng.randint(0, 59)), datetime.time(14), datetime.time(15, 59), datetime.time(16)]),
+            total_cents=rng.choice([rng.randint(-10000, 10000), 25 * rng.randint(-400, 400), 100 * rng.randint(-100, 100)]),
+        )
+        Item.objects.using(receipt._state.db).bulk_create(
+            Item(
+                receipt=receipt,
+                shortDescription="".join(rng.choices(self.CHARACTERS, k=rng.randint(0, 10))),
+                price_cents=rng.randint(-3000, 3000),
+            )
+            for _ in range(rng.randint(0, 7))
+        )
+        return receipt
+
+
+    def test_with_points_agrees_with_get_points(self):
+        '''
+        A property test: on randomly generated receipts, the score with_points computes
+        in SQL is the one get_points computes in Python. The seed is fixed so failures
+        reproduce.
+        '''
+        rng = random.Random(38)
+        for number in range(300):
+            self.random_receipt(rng, number)
+
+        for alias in shard_aliases():
+            for receipt in Receipt.objects.using(alias).with_points():
+                self.assertEqual(receipt.computed_points, receipt.get_points(), f"{receipt.retailer!r} {receipt}")
+
+
+    def test_with_points_scores_a_queryset_in_one_query(self):
+        '''
+        Items are scored in a subquery, so scoring any number of receipts with their
+        items takes a single query per shard.
+        '''
+        rng = random.Random(0)
+        receipts = [self.random_receipt(rng, number) for number in range(20)]
+
+        for alias in shard_aliases():
+            with self.assertNumQueries(1, using=alias):
+                scored = list(Receipt.objects.using(alias).with_points())
+            self.assertEqual(len(scored), sum(receipt._state.db == alias for receipt in receipts))
+
+
+    def test_with_points_filters_and_orders_by_score(self):
+        '''
+        computed_points is an ordinary annotation, so querysets can filter and sort on it.
+        '''
+        low, high = shard_0_receipt_ids(2)
+        Receipt.objects.create(hexadecimal_id=low, retailer="A", purchaseDate="2022-01-02", purchaseTime="10:00", total_cents=101)
+        Receipt.objects.create(hexadecimal_id=high, retailer="Target", purchaseDate="2022-01-01", purchaseTime="14:33", total_cents=3500)
+
+        scored = Receipt.objects.with_points().filter(computed_points__gt=1)
+        self.assertEqual([receipt.hexadecimal_id for receipt in scored.order_by("-computed_points")], [high])
+        self.assertEqual(scored.get().computed_points, 6 + 50 + 25 + 6 + 10)
+
+
+@override_settings(RECEIPTS_PROFILING=True, RECEIPTS_PROFILING_TOKEN="secret", RECEIPTS_PROFILING_SAMPLE_RATE=0.0)
+class ProfilingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def setUp(self):
+        profiling.clear()
+
+
+    @override_settings(RECEIPTS_PROFILING=False)
+    def test_middleware_is_not_installed_when_profiling_is_off(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+        response = post_receipt(self, receipt_json_with_items(3), **{"X-Receipts-Profile": "secret"})
+        self.assertNotIn(PROFILE_ID_HEADER, response)
+        self.assertEqual(profiling.recent(), [])
+
+
+    def test_authorized_header_profiles_the_view_and_its_sql(self):
+        self.assertNotIn(PROFILE_ID_HEADER, post_receipt(self, receipt_json_with_items(3), **{"X-Receipts-Profile": "wrong"}))
+
+        response = post_receipt(self, receipt_json_with_items(3), **{"X-Receipts-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        profile = profiling.get(int(response[PROFILE_ID_HEADER]))
+
+        self.assertEqual((profile["view"], profile["trigger"], profile["status"]), ("receipts:get_id_for_receipt", "header", 200))
+        # ingest scores the receipt inline, so get_points is in the call tree with its caller
+        get_points = next(function for function in profile["functions"] if function["function"].endswith("(get_points)"))
+        self.assertTrue(any(caller.endswith("(add)") for caller in get_points["callers"]))
+        self.assertEqual(profile["query_count"], len(profile["sql"]))
+        self.assertTrue(any(query["sql"].startswith("INSERT") for query in profile["sql"]))
+        self.assertEqual(profiling.recent(), [profile])
+
+
+    @override_settings(RECEIPTS_PROFILING_SAMPLE_RATE=1.0, RECEIPTS_PROFILING_MAX_PROFILES=3)
+    def test_sampled_profiles_are_kept_in_a_bounded_ring(self):
+        ids = [int(post_receipt(self, receipt_json_with_items(3))[PROFILE_ID_HEADER]) for _ in range(5)]
+
+        self.assertEqual([profile["id"] for profile in profiling.recent()], ids[:1:-1])
+        self.assertEqual({profile["trigger"] for profile in profiling.recent()}, {"sampled"})
+
+
+    @override_settings(RECEIPTS_PROFILING_SAMPLE_RATE=1.0)
+    def test_profiles_are_served_to_staff_only(self):
+        profile_id = int(post_receipt(self, receipt_json_with_items(3))[PROFILE_ID_HEADER])
+        list_url, detail_url = reverse("receipts:profiles"), reverse("receipts:profile", args=(profile_id,))
+
+        for url in (list_url, detail_url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(reverse("admin:login"), response["Location"])
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        listing = self.client.get(list_url).json()["profiles"]
+        self.assertEqual([profile["id"] for profile in listing], [profile_id])
+        self.assertNotIn("functions", listing[0])
+        self.assertEqual(self.client.get(detail_url).json()["view"], "receipts:get_id_for_receipt")
+        self.assertEqual(self.client.get(reverse("receipts:profile", args=(profile_id + 1,))).status_code, 404)
+        # reading profiles isn't profiled itself
+        self.assertEqual(len(profiling.recent()), 1)
+
+
+class LoadTestTests(SimpleTestCase):
+    def test_histogram_percentiles_are_within_one_percent(self):
+        histogram = LatencyHistogram()
+        for micros in range(1, 100_001):
+            histogram.record(micros / 1e6)
+        for percent in (50, 90, 99, 99.9):
+            self.assertAlmostEqual(histogram.percentile(percent), percent / 100 * 0.1, delta=percent / 100 * 0.1 / 100)
+        self.assertEqual(histogram.percentile(100), 0.1)
+
+
+    def test_synthetic_traces_round_trip_through_ndjson(self):
+        trace = synthetic_trace(200, rate=50, points_ratio=0.8, seed=1)
+        self.assertEqual(read_trace(json.dumps(request) for request in trace), trace)
+        self.assertEqual(trace[0]["endpoint"], "process")
+        self.assertTrue(all(trace[request["ref"]]["endpoint"] == "process" for request in trace if request["endpoint"] == "points"))
+
+        with self.assertRaises(ValueError):
+            read_trace(['{"t": 0, "endpoint": "points", "ref": 0}'])
+
+
+class TrafficReplayTests(LiveServerTestCase):
+    databases = SHARD_DATABASES
+
+    def test_closed_loop_replay_against_a_live_server(self):
+        replay = Replay(synthetic_trace(30, rate=100, points_ratio=0.5), self.live_server_url)
+        report = replay.report(replay.run_closed_loop(concurrency=1))
+
+        self.assertEqual(report["process"]["error_rate"], 0)
+        self.assertEqual(report["points"]["error_rate"], 0)
+        self.assertEqual(report["process"]["requests"] + report["points"]["requests"], 30)
+        self.assertGreater(report["points"]["p50_ms"], 0)
+
+
+class StartupTests(TestCase):
+    # makemigrations checks every database's migration history
+    databases = SHARD_DATABASES
+
+    def test_committed_migrations_match_the_models(self):
+        '''
+        Test that no migration is missing, since the container no longer runs makemigrations at boot.
+        '''
+        # exits non-zero (SystemExit) when a migration would be generated
+        call_command("makemigrations", check=True, dry_run=True, verbosity=0)
+
+
+    @mock.patch("mysite.startup._marks", [])
+    def test_startup_report_breaks_down_time_between_marks(self):
+        from mysite import startup
+
+        startup.mark("manage.py started")
+        startup.mark("apps ready")
+        report = startup.report()
+        self.assertIn("apps ready", report)
+        self.assertIn("total", report)
+
+
+    @mock.patch("mysite.startup._marks", [
+        ("process exec", 0.0),
+        ("manage.py started", 0.1),
+        ("handler ready", 0.3),
+        ("listening", 0.31),
+        ("first request received", 60.31),
+        ("first request served", 60.325),
+    ])
+    def test_startup_report_leaves_out_the_wait_for_the_first_request(self):
+        from mysite import startup
+
+        lines = [line.split() for line in startup.report().splitlines()]
+        self.assertIn(["idle", "until", "first", "request", "+", "60000.0", "ms"], lines)
+        self.assertIn(["startup", "total", "310.0", "ms"], lines)
+        self.assertIn(["first", "request", "15.0", "ms"], lines)
+
+
+    def test_whitespace_is_every_character_str_strip_removes(self):
+        import sys
+
+        self.assertEqual(WHITESPACE, "".join(c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace()))
+
+
+    def test_runserver_skips_the_migration_check_with_skip_checks(self):
+        from receipts.management.commands.runserver import Command
+
+        for skip_checks in (True, False):
+            command = Command()
+            command.skip_migration_check = skip_checks
+            with self.subTest(skip_checks=skip_checks), \
+                    mock.patch("django.core.management.base.BaseCommand.check_migrations") as check_migrations:
+                command.check_migrations()
+                self.assertEqual(check_migrations.called, not skip_checks)
+
+
+@override_settings(RECEIPTS_STORAGE_BACKEND="receipts.storage.InMemoryReceiptStore")
+class InMemoryStorageReceiptViewTests(ReceiptViewTests):
+    '''
+    The same API tests as ReceiptViewTests, against the in-memory storage backend.
+    '''
+
+    def test_floating_point_precision_for_more_than_2_decimal_places_receipt_total(self):
+        # the in-memory store keeps the receipt, but not as a Receipt row
+        json_string = '''
+        {
+            "retailer": "Walgreens",
+            "purchaseDate": "2022-01-02",
+            "purchaseTime": "08:13",
+            "total": "2.6592568",
+            "items": []
+        }
+        '''
+
+        url = reverse("receipts:get_id_for_receipt")
+        response = self.client.post(url, {"receipt_json_str": json_string})
+        self.assertEqual(response.status_code, 200)
+        hex_id = json.loads(response.content.decode("utf-8"))["id"]
+        self.assertEqual(get_receipt_store().get_record(hex_id).total_cents, 266)
+        self.assertFalse(Receipt.objects.using(db_for_receipt_id(hex_id)).filter(pk=hex_id).exists())
+
+
+@override_settings(RECEIPTS_STORAGE_BACKEND="receipts.storage.InMemoryReceiptStore")
+class InMemoryStorageReceiptListingTests(ReceiptListingTests):
+    '''
+    The same listing tests as ReceiptListingTests, against the in-memory storage backend.
+    '''
+
+    def setUp(self):
+        # the store lives as long as the process; start every test from an empty one
+        reset_receipt_stores(setting="RECEIPTS_STORAGE_BACKEND")
+
+
+    def test_listing_includes_points_of_unscored_receipts_within_budget(self):
+        # the in-memory store scores every receipt on ingest, and runs no queries to list them
+        receipts = [post_receipt(self, receipt_json_with_items(3, "Target", f"2022-01-{day:02}")).json()["id"] for day in range(1, 7)]
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("receipts:list_receipts"), {"include": "points"})
+        listed = {receipt["id"]: receipt["points"] for receipt in response.json()["receipts"]}
+        self.assertEqual(listed, {hex_id: get_receipt_store().get_points(hex_id) for hex_id in receipts})
+
+
+class InMemoryReceiptStoreTests(SimpleTestCase):
+    @override_settings(RECEIPTS_MEMORY_MAX_RECEIPTS=4, RECEIPTS_MEMORY_STRIPES=1)
+    def test_oldest_receipts_are_evicted_past_the_size_cap(self):
+        store = InMemoryReceiptStore()
+        receipt = Receipt(retailer="Target", purchaseDate=datetime.date(2022, 1, 1), purchaseTime=datetime.time(13, 1), total_cents=3535)
+        ids = [store.add(receipt, []) for _ in range(6)]
+
+        self.assertEqual(len(store), 4)
+        for evicted in ids[:2]:
+            with self.assertRaises(Receipt.DoesNotExist):
+                store.get_record(evicted)
+        with self.assertRaises(Receipt.DoesNotExist):
+            store.get_points(ids[0])
+        self.assertEqual(store.get_record(ids[5]).total_cents, 3535)
+        self.assertEqual(store.get_points(ids[5]), receipt.get_points([]))
@@ -10,6 +10,18 @@ urlpatterns = [
     # ex: /receipts/process/
     path("process", views.get_id_for_receipt, name="get_id_for_receipt"),
 
+    # ex: /receipts/list?retailer=Target&purchaseDateFrom=2022-01-01&include=points
+    path("list", views.list_receipts, name="list_receipts"),
+
     # ex: /receipts/{id}/points
-    path("<str:receipt_id>/points", views.points, name="points")
+    path("<str:receipt_id>/points", views.points, name="points"),
+
+    # ex: /receipts/metrics, for staff users
+    path("metrics", views.metrics_snapshot, name="metrics"),
+
+    # ex: /receipts/profiles, for staff users
+    path("profiles", views.profiles, name="profiles"),
+
+    # ex: /receipts/profiles/3
+    path("profiles/<int:profile_id>", views.profile, name="profile"),
 ]
\ No newline at end of file
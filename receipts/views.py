@@ -1,23 +1,33 @@
-from django.http import HttpResponse, HttpResponseNotFound, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, Http404
 from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 
-from .models import Receipt, Item
+from . import metrics, profiling
+from .models import Receipt, Item, cents_to_dollars, dollars_to_cents, to_python_fields
+from .pagination import decode_cursor
+from .query_budget import note_batched_rows, query_budget
 from .settings import DEBUG
+from .storage import ITEM_INSERT_BATCH_SIZE, get_receipt_store
 
-import random
+import datetime
 import json
 
 
-def get_random_hexadecimal_id() -> str:
-    randint_1 = random.randint(0, 16**8-1)
-    randint_2 = random.randint(0, 16**4-1)
-    randint_3 = random.randint(0, 16**4-1)
-    randint_4 = random.randint(0, 16**4-1)
-    randint_5 = random.randint(0, 16**12-1)
+# The ETag carries the points, so staff editing a receipt in the admin changes it;
+# bump the version whenever get_points changes. Caches may serve points without
+# revalidating for POINTS_CACHE_MAX_AGE seconds, which bounds how stale an edit can be.
+POINTS_ETAG_VERSION = 1
+POINTS_CACHE_MAX_AGE = 60
 
-    return '-'.join([hex(randint_1)[2:], hex(randint_2)[2:], hex(randint_3)[2:], hex(randint_4)[2:], hex(randint_5)[2:]])
+LIST_DEFAULT_LIMIT = 25
+LIST_MAX_LIMIT = 100
 
 
+# collision check, the receipt, its items in bulk inserts of ITEM_INSERT_BATCH_SIZE, its scoring
+# job, and the transaction around them (BEGIN, or SAVEPOINT and RELEASE when nested as under tests)
+@query_budget(6, batch_size=ITEM_INSERT_BATCH_SIZE)
 def get_id_for_receipt(request):
     if request.method == "POST":
         receipt_json_str = request.POST['receipt_json_str']
@@ -39,11 +49,6 @@ def get_id_for_receipt(request):
         )
         '''
 
-        random_hex_id = get_random_hexadecimal_id()
-        # in the (very!) unlikely case of a collision, regenerate the ID until it's unique
-        while random_hex_id in Receipt.objects.values_list('hexadecimal_id', flat=True):
-            random_hex_id = get_random_hexadecimal_id()
-
         try:
             data = json.loads(receipt_json_str)
 
@@ -53,13 +58,18 @@ def get_id_for_receipt(request):
             total = data['total']
             items = data['items']
 
-            receipt = Receipt.objects.create(hexadecimal_id=random_hex_id, retailer=retailer, purchaseDate=purchaseDate, purchaseTime=purchaseTime, total=total)
-
+            receipt = Receipt(retailer=retailer, purchaseDate=purchaseDate, purchaseTime=purchaseTime, total_cents=dollars_to_cents(total))
+            to_python_fields(receipt)
+            receipt_items = []
             for item in items:
                 shortDescription = item['shortDescription']
                 price = item['price']
-                receipt.item_set.create(shortDescription=shortDescription, price=price)
+                receipt_item = Item(shortDescription=shortDescription, price_cents=dollars_to_cents(price))
+                to_python_fields(receipt_item)
+                receipt_items.append(receipt_item)
 
+            note_batched_rows(request, len(receipt_items))
+            random_hex_id = get_receipt_store().add(receipt, receipt_items)
             return JsonResponse({'id': random_hex_id})
         except Exception as e:
             return HttpResponseBadRequest("The receipt is invalid.")
@@ -80,19 +90,133 @@ def get_id_for_receipt(request):
         return HttpResponseBadRequest("Invalid request method, this can only take POST")
 
 
+@query_budget(0)
 def accept_receipt_as_user_input(request):
     return render(request, "receipts/upload_receipt_and_get_id.html")
 
 
+def points_etag(receipt_id: str, points: int) -> str:
+    return f'"points-v{POINTS_ETAG_VERSION}-{receipt_id}-{points}"'
+
+
+def if_none_match(request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if header is None:
+        return False
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    etags = {tag.removeprefix("W/") for tag in parse_etags(header)}
+    return "*" in etags or etag in etags
+
+
+def patch_points_caching(response, etag: str):
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=POINTS_CACHE_MAX_AGE)
+    return response
+
+
+# the receipt, a fallback to the primary when the replica is behind, and its items or
+# scoring job when it hasn't been scored yet
+@query_budget(3)
 def points(request, receipt_id: str) -> JsonResponse:
     if request.method == "GET":
         if DEBUG:
             print(f"Receipt json string received: {receipt_id}")
         try:
-            receipt = Receipt.objects.get(pk=receipt_id)
+            points = get_receipt_store().get_points(receipt_id)
         except Receipt.DoesNotExist:
             return HttpResponseNotFound("No receipt found for that ID.")
-        else:
-            return JsonResponse({'points': receipt.get_points()})
+
+        if points is None:
+            # still queued for the background scoring workers; not cacheable
+            response = JsonResponse({'status': 'pending'}, status=202)
+            response["Retry-After"] = "1"
+            return response
+
+        etag = points_etag(receipt_id, points)
+        if if_none_match(request, etag):
+            # the client already has these points; the stored score was all it took to tell
+            return patch_points_caching(HttpResponseNotModified(), etag)
+        return patch_points_caching(JsonResponse({'points': points}), etag)
+    else: # POST used to call this endpoint
+        return HttpResponseBadRequest("Invalid request method, this can only take GET")
+
+
+def receipt_summary(receipt: Receipt, include_points: bool) -> dict:
+    summary = {
+        'id': receipt.hexadecimal_id,
+        'retailer': receipt.retailer,
+        'purchaseDate': receipt.purchaseDate.isoformat(),
+        'purchaseTime': receipt.purchaseTime.strftime("%H:%M"),
+        'total': cents_to_dollars(receipt.total_cents),
+    }
+    if include_points:
+        summary['points'] = receipt.points
+    return summary
+
+
+# a keyset page, and the items of its unscored receipts when points are included
+@query_budget(2, per_shard=True)
+def list_receipts(request) -> JsonResponse:
+    if request.method == "GET":
+        try:
+            limit = int(request.GET.get("limit", LIST_DEFAULT_LIMIT))
+            if not 1 <= limit <= LIST_MAX_LIMIT:
+                raise ValueError(f"limit must be between 1 and {LIST_MAX_LIMIT}")
+            cursor = request.GET.get("cursor") or None
+            if cursor is not None:
+                decode_cursor(cursor)
+            purchased_from = request.GET.get("purchaseDateFrom")
+            purchased_to = request.GET.get("purchaseDateTo")
+            filters = {
+                'retailer': request.GET.get("retailer"),
+                'purchased_from': datetime.date.fromisoformat(purchased_from) if purchased_from else None,
+                'purchased_to': datetime.date.fromisoformat(purchased_to) if purchased_to else None,
+            }
+        except ValueError:
+            return HttpResponseBadRequest("Invalid listing parameters.")
+        include_points = "points" in request.GET.get("include", "").split(",")
+
+        try:
+            receipts, next_cursor = get_receipt_store().list_receipts(cursor, limit, include_points=include_points, **filters)
+        except NotImplementedError:
+            return HttpResponse("Listing receipts isn't supported by this storage backend.", status=501)
+        return JsonResponse({
+            'receipts': [receipt_summary(receipt, include_points) for receipt in receipts],
+            'next': next_cursor,
+        })
+    else: # POST used to call this endpoint
+        return HttpResponseBadRequest("Invalid request method, this can only take GET")
+
+
+# the session and its user, for the staff check
+@query_budget(2)
+@staff_member_required
+def metrics_snapshot(request) -> JsonResponse:
+    return JsonResponse(metrics.snapshot())
+
+
+# the session and its user, for the staff check
+@query_budget(2)
+@staff_member_required
+def profiles(request) -> JsonResponse:
+    if request.method == "GET":
+        # the call tree and SQL timeline are left out of the list; see `profile`
+        summaries = [
+            {key: value for key, value in profile.items() if key not in ("functions", "sql")}
+            for profile in profiling.recent()
+        ]
+        return JsonResponse({"profiles": summaries})
+    else: # POST used to call this endpoint
+        return HttpResponseBadRequest("Invalid request method, this can only take GET")
+
+
+@query_budget(2)
+@staff_member_required
+def profile(request, profile_id: int):
+    if request.method == "GET":
+        found = profiling.get(profile_id)
+        if found is None:
+            return HttpResponseNotFound("No profile found for that ID.")
+        return JsonResponse(found)
     else: # POST used to call this endpoint
-        return HttpResponseBadRequest("Invalid request method, this can only take GET")
\ No newline at end of file
+        return HttpResponseBadRequest("Invalid request method, this can only take GET")